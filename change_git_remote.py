@@ -1,62 +1,185 @@
 import os
-import git
-import subprocess
-
-
-# Function to normalize and convert the Gitlab URL to Https format
-def normalize_and_convert_gitlab_url(gitlab_url):
-    gitlab_url = gitlab_url.strip()
-    if not gitlab_url.endswith(".git"):
-        gitlab_url = gitlab_url + ".git"
-    if gitlab_url.startswith("git@gitlab.com:"):
-        gitlab_url = gitlab_url.replace("git@gitlab.com:", "https://gitlab.com/")
-    return gitlab_url
-
-# Read the remote mapping from remote-list.txt
-remote_mapping = {}
-with open("remote-list.txt", "r") as remote_file:
-    for line in remote_file:
-        gitlab_remote, github_remote = line.strip().split('\t')
-        remote_mapping[gitlab_remote] = github_remote
-
-# Get the list of directories in the current context
-directories = [d for d in os.listdir() if os.path.isdir(d)]
-
-# Iterate through the directories and update Git repositories
-for directory in directories:
-    print(f"**** Checking {directory} Folder ****")
-    repo_path = os.path.join(os.getcwd(), directory)
-    
-    # Check if it's a Git repository
+import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from url_rewriter import RepositoryUrlIndex, get_remote_mapping
+
+# Number of repositories whose config is rewritten at the same time
+CHANGE_REMOTE_WORKERS = int(os.getenv("CHANGE_REMOTE_WORKERS", 16))
+
+REMOTE_SECTION_PATTERN = re.compile(r'^\s*\[\s*remote\s+"(?P<name>(?:[^"\\]|\\.)*)"\s*\]\s*$')
+SECTION_PATTERN = re.compile(r'^\s*\[')
+REMOTE_URL_PATTERN = re.compile(r'^(?P<key>\s*(?:url|pushurl)\s*=\s*)(?P<url>.*?)(?P<end>\s*)$', re.IGNORECASE)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Point the remotes of the local git repositories to their new GitHub repositories")
+    parser.add_argument("root", nargs="?", default=os.getcwd(), help="Directory searched recursively for git repositories (default: current directory)")
+    parser.add_argument("--mapping", default="remote-list.txt", help="Remote mapping file (Old_Gitlab_Remote, New_Github_Remote), default: remote-list.txt")
+    parser.add_argument("--workers", type=int, default=CHANGE_REMOTE_WORKERS, help=f"Number of repositories updated at the same time (default: {CHANGE_REMOTE_WORKERS})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the remotes that would be changed")
+    return parser.parse_args()
+
+
+def find_git_repositories(root_directory):
+    # Yield the working tree of every git repository under root_directory
+    # The search does not go inside a repository: nested repositories are submodules, not checkouts
+    directories = [root_directory]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        if any(entry.name == ".git" for entry in entries):
+            yield directory
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+
+
+def get_git_config_path(repo_path):
+    # .git is a directory, or a "gitdir: <path>" file for worktrees and submodules
+    git_path = os.path.join(repo_path, ".git")
+    if os.path.isdir(git_path):
+        return os.path.join(git_path, "config")
+    with open(git_path, "r") as file:
+        git_directory = file.read().strip()[len("gitdir:"):].strip()
+    git_directory = os.path.normpath(os.path.join(repo_path, git_directory))
+    # A worktree shares the config of its main repository
+    common_directory_path = os.path.join(git_directory, "commondir")
+    if os.path.exists(common_directory_path):
+        with open(common_directory_path, "r") as file:
+            git_directory = os.path.normpath(os.path.join(git_directory, file.read().strip()))
+    return os.path.join(git_directory, "config")
+
+
+def get_new_remote_url(url_index, remote_url):
+    # New GitHub remote of the url in the ssh format, or None when the url is not in the mapping
+    new_remote_url = url_index.lookup(remote_url)
+    if not new_remote_url:
+        return None
+
+    # Change the remote URL to SSH format
+    if new_remote_url.startswith("https://github.com"):
+        new_remote_url = new_remote_url.replace("https://github.com/", "git@github.com:")
+        if not new_remote_url.endswith(".git"):
+            new_remote_url += ".git"
+    return new_remote_url
+
+
+def rewrite_remote_urls(config_content, url_index):
+    # Return the new config content and the list of (remote, old url, new url) changes
+    # Only the url values are replaced, the rest of the file is kept as is
+    changes = []
+    lines = config_content.splitlines(keepends=True)
+    remote_name = None
+    for index, line in enumerate(lines):
+        section_match = REMOTE_SECTION_PATTERN.match(line)
+        if section_match:
+            remote_name = section_match.group("name")
+            continue
+        if SECTION_PATTERN.match(line):
+            remote_name = None
+            continue
+        if remote_name is None:
+            continue
+
+        url_match = REMOTE_URL_PATTERN.match(line.rstrip("\r\n"))
+        if not url_match:
+            continue
+        remote_url = url_match.group("url").strip('"')
+        new_remote_url = get_new_remote_url(url_index, remote_url)
+        if new_remote_url and new_remote_url != remote_url:
+            line_ending = line[len(line.rstrip("\r\n")):]
+            lines[index] = f"{url_match.group('key')}{new_remote_url}{url_match.group('end')}{line_ending}"
+            changes.append((remote_name, remote_url, new_remote_url))
+    return "".join(lines), changes
+
+
+def write_git_config(config_path, url_index):
+    # Take the lock of the config file like git does, rewrite the config read under the lock, then replace the file in one step
+    # Returns the list of (remote, old url, new url) changes
+    lock_path = config_path + ".lock"
+    file_descriptor = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        with os.fdopen(file_descriptor, "w", newline="") as lock_file:
+            with open(config_path, "r", newline="") as file:
+                config_content = file.read()
+            new_config_content, changes = rewrite_remote_urls(config_content, url_index)
+            lock_file.write(new_config_content)
+        if changes:
+            os.replace(lock_path, config_path)
+        else:
+            os.remove(lock_path)
+        return changes
+    except BaseException:
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+        raise
+
+
+def update_repository_remotes(repo_path, config_path, url_index, dry_run=False):
+    # Returns had_error, error_message and the list of (remote, old url, new url) changes
+    had_error = False
+    error_message = ""
+    changes = []
     try:
-        repo = git.Repo(repo_path)
-    except git.exc.InvalidGitRepositoryError:
-        print(f"{directory} is not a Git repository")
-        continue
-    
-    print(f"{directory} is a Git repository")
-    origin_url = repo.remotes.origin.url
-
-    normalized_origin_url = normalize_and_convert_gitlab_url(origin_url)
-
-    print(f"Checking Origin Remote")
-    # Check if the origin remote exists in the mapping
-    if normalized_origin_url in remote_mapping:
-        print(f"Origin Remote: {normalized_origin_url} has a matching remote in the mapping.")
-        new_remote_url = remote_mapping[normalized_origin_url]
-        
-        # Change the remote URL to SSH format
-        if new_remote_url.startswith("https://github.com"):
-            new_remote_url = new_remote_url.replace("https://github.com/", "git@github.com:")
-            if not new_remote_url.endswith(".git"):
-                new_remote_url += ".git"
-        
-        print(f"Updating repository in {directory} from {origin_url} to {new_remote_url}")
-
-        # Set the new remote URL
-        subprocess.run(["git", "remote", "set-url", "origin", new_remote_url], cwd=repo_path, stdout=subprocess.PIPE)
-        print(f"Repository in {directory} updated successfully.")
-    else:
-        print(f"Repository in {directory} has no matching remote in the mapping.")
-
-print("Finished updating repositories.")
+        if dry_run:
+            with open(config_path, "r", newline="") as file:
+                changes = rewrite_remote_urls(file.read(), url_index)[1]
+        else:
+            changes = write_git_config(config_path, url_index)
+    except Exception as e:
+        had_error = True
+        error_message = f"===> An error occurred while updating {repo_path}: {str(e)}"
+    return had_error, error_message, changes
+
+
+def change_git_remotes(root_directory, mapping_file_path="remote-list.txt", workers=CHANGE_REMOTE_WORKERS, dry_run=False):
+    # Point the remotes of every repository under root_directory to their new GitHub repository
+    # Returns {repo_path: (had_error, error_message, changes)}
+    url_index = RepositoryUrlIndex(get_remote_mapping(mapping_file_path))
+    print(f"Remote mapping: {len(url_index)} repositories")
+
+    repo_paths = list(find_git_repositories(root_directory))
+    print(f"Found {len(repo_paths)} git repositories in {root_directory}")
+
+    # The worktrees of a repository share its config, each config file is only updated once
+    # The path of a config is resolved: it is built from the root argument or from the absolute path of a "gitdir:" file
+    results = {}
+    config_paths = {}
+    for repo_path in repo_paths:
+        try:
+            config_paths.setdefault(os.path.realpath(get_git_config_path(repo_path)), repo_path)
+        except OSError as e:
+            results[repo_path] = (True, f"===> An error occurred while reading {repo_path}: {str(e)}", [])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        updates = executor.map(lambda config_path: update_repository_remotes(config_paths[config_path], config_path, url_index, dry_run), config_paths)
+        results.update(zip(config_paths.values(), updates))
+
+    for repo_path, (had_error, error_message, changes) in results.items():
+        relative_path = os.path.relpath(repo_path, root_directory)
+        if had_error:
+            print(error_message)
+        elif not changes:
+            print(f"Repository in {relative_path} has no matching remote in the mapping.")
+        for remote_name, remote_url, new_remote_url in changes:
+            action = "Would update" if dry_run else "Updated"
+            print(f"{action} remote {remote_name} of {relative_path} from {remote_url} to {new_remote_url}")
+    return results
+
+
+def main():
+    args = parse_arguments()
+    results = change_git_remotes(args.root, args.mapping, args.workers, args.dry_run)
+
+    updated_count = sum(1 for _, _, changes in results.values() if changes)
+    failed_count = sum(1 for had_error, _, _ in results.values() if had_error)
+    print(f"Finished updating repositories: {updated_count} {'to update' if args.dry_run else 'updated'}, {failed_count} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import time
+
+# Steps of a project, the pom.xml step is also recorded branch by branch
+STEP_RENAME = "rename"
+STEP_POM = "pom"
+STEP_DEVOPS = "devops"
+
+# Steps of a merge request migration: the last sync time of the project and the pull request of each merge request
+STEP_MERGE_REQUEST_WATERMARK = "merge-request-watermark"
+
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+
+
+def get_pom_branch_step(branch_name):
+    return f"{STEP_POM}:{branch_name}"
+
+
+def get_merge_request_step(merge_request_iid):
+    return f"merge-request:{merge_request_iid}"
+
+
+class CheckpointJournal:
+    # Durable record of the refactoring steps, written as soon as each step ends so that a re-run can skip them
+    # A step is keyed by the project (its Gitlab url) and the step name, only its last status is kept
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.lock = threading.Lock()
+        # The connection is shared by the project workers, the lock serializes its use
+        # Other processes may write to the same journal, a locked database is waited for
+        self.connection = sqlite3.connect(database_path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS steps ("
+                " project TEXT NOT NULL,"
+                " step TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " detail TEXT NOT NULL DEFAULT '',"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (project, step))"
+            )
+
+    def record_step(self, project, step, status, detail=""):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO steps (project, step, status, detail, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (project, step, status, detail or "", time.time()),
+            )
+
+    def get_step(self, project, step):
+        # Returns (status, detail), or None when the step never ran
+        with self.lock:
+            return self.connection.execute("SELECT status, detail FROM steps WHERE project = ? AND step = ?", (project, step)).fetchone()
+
+    def is_step_done(self, project, step):
+        step_record = self.get_step(project, step)
+        return step_record is not None and step_record[0] == STEP_DONE
+
+    def get_done_pom_branches(self, project):
+        prefix = get_pom_branch_step("")
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT step FROM steps WHERE project = ? AND status = ? AND substr(step, 1, ?) = ?",
+                (project, STEP_DONE, len(prefix), prefix),
+            ).fetchall()
+        return {step[len(prefix):] for step, in rows}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
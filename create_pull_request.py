@@ -1,24 +1,65 @@
 import os
+import time
 import getpass
-from github import Github
+import threading
+from github_client import GITHUB_API_URL, get_github_repository, github_call, github_get, github_graphql, github_request
+from member_directory import MemberDirectory
 from dotenv import load_dotenv
 
-
-def create_github_pull_request(github_token, organization_name, repo_name, merge_request_obj, org_members):
-
-    # Create instance of Github auth
-    g = Github(github_token)
-
+# Seconds a loaded collaborator set is trusted, it is then revalidated with conditional requests (a 304 answer costs no rate limit)
+GITHUB_COLLABORATORS_TTL = int(os.getenv("GITHUB_COLLABORATORS_TTL", 600))
+COLLABORATORS_PAGE_SIZE = 100
+MILESTONES_PAGE_SIZE = 100
+
+# Fold the Gitlab comments into a single digest comment instead of one comment per note
+PULL_REQUEST_DIGEST_COMMENTS = os.getenv("PULL_REQUEST_DIGEST_COMMENTS", "false").lower() in ("1", "true", "yes")
+# GitHub rejects comments longer than 65536 characters, a longer digest is split
+MAX_COMMENT_LENGTH = 65000
+
+# Directory where the member directory of each organization is saved between runs
+MEMBER_DIRECTORY_CACHE_DIRECTORY = os.getenv("MEMBER_DIRECTORY_CACHE_DIR", ".member_directory_cache")
+# Seconds a saved member directory is reused before being fetched again from GitHub
+MEMBER_DIRECTORY_MAX_AGE = int(os.getenv("MEMBER_DIRECTORY_MAX_AGE", 86400))
+
+# Members of an organization with their name, 100 per page (the GraphQL maximum)
+ORGANIZATION_MEMBERS_QUERY = """
+query($organization: String!, $cursor: String) {
+  organization(login: $organization) {
+    membersWithRole(first: 100, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { login name }
+    }
+  }
+}
+"""
+
+
+# Steps run on a pull request after its creation, recorded in its progress so that an interrupted pull request is
+# completed by a later run instead of being created again
+PULL_REQUEST_STEP_REVIEWERS = "reviewers"
+# Assignee, labels and milestone
+PULL_REQUEST_STEP_ISSUE = "issue"
+# Gitlab merge request url comment
+PULL_REQUEST_STEP_URL_COMMENT = "url-comment"
+PULL_REQUEST_STEPS = (PULL_REQUEST_STEP_REVIEWERS, PULL_REQUEST_STEP_ISSUE, PULL_REQUEST_STEP_URL_COMMENT)
+
+
+def create_github_pull_request(github_token, organization_name, repo_name, merge_request_obj, org_members, digest_comments=PULL_REQUEST_DIGEST_COMMENTS, on_progress=None):
+    # Returns the pull request url (None when it could not be created) and an error message
+    # Once the pull request is created, its url is returned even when setting its reviewers, assignee, labels, milestone
+    # or comments failed: the pull request exists on GitHub and must not be created again
+    # on_progress(progress) is called when the pull request is created and after each step completing it (see complete_pull_request)
+    pull_request = None
     try:
         print("Connection to github repo")
 
-        # Get Github repo
-        repo = g.get_repo(repo_name)
+        # Get Github repo, the handle is shared by all the pull requests of the repository
+        repo = get_github_repo(github_token, repo_name)
         
         print("Creating pull request")
 
         # Create pull request
-        pull_request = repo.create_pull(
+        pull_request = github_call(github_token, repo.create_pull, write=True,
             title=merge_request_obj["title"],
             body=merge_request_obj["description"],
             base=merge_request_obj["target_branch"],
@@ -27,71 +68,287 @@ def create_github_pull_request(github_token, organization_name, repo_name, merge
             # draft=merge_request_obj["is_drafted"]
         )
 
-        assignee = merge_request_obj["assignee"]
-        if assignee and assignee != "None":
-
-            print(f"Assignee: {assignee}")
-            username = get_username_by_full_name(org_members, assignee)
-            print(f"Username: {username}")
-
-            if is_collaborator(repo, username):
-                pull_request.add_to_assignees(username)
-            else:
-                print(f"Skipping assignee {assignee} as he is not a collaborator")
-
-        reviewers = merge_request_obj["reviewers"]
-        if reviewers and reviewers != []:
-            for reviewer in reviewers:
-
-                print(f"Reviewer: {reviewer}")
-                username = get_username_by_full_name(org_members, reviewer)
-                print(f"Username: {username}")                
-
-                if is_collaborator(repo, username):
-                    pull_request.create_review_request([username])
-                else:
-                    print(f"Skipping reviewer {reviewer} as he is not a collaborator")
-
-        labels = merge_request_obj["labels"]
-        if labels and labels != "None":
-            labels = [label.strip() for label in labels.split(',')]
-            pull_request.add_to_labels(*labels)
-
-        milestone = merge_request_obj["milestone"]
-        if milestone and milestone != "None":
-            pull_request.set_milestone(milestone)
+        progress = {"pull_request_number": pull_request.number, "last_note_id": 0, "steps": []}
+        if on_progress:
+            on_progress(progress)
 
         # TODO verify existence
         # pull_request.set_time_tracking(time_estimate, time_spent)
 
-        comments = merge_request_obj["comments"]
-        if comments and comments != "None":
-            for comment in comments:
-                # Add each comment as a separate issue comment
-                pull_request.create_issue_comment(comment)
-
-        # Add Gitlab merge request urls as comment
-        last_comment = f"Gitlab Merge Request URL: {merge_request_obj['url']}"
-        pull_request.create_issue_comment(last_comment)
+        complete_pull_request(github_token, repo_name, merge_request_obj, org_members, progress, digest_comments, on_progress)
 
         # Return pull request URL
-        return pull_request.html_url
+        return pull_request.html_url, ""
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-        return None
-
-
+        return (pull_request.html_url if pull_request else None), str(e)
+
+
+def complete_pull_request(github_token, repo_name, merge_request_obj, org_members, progress, digest_comments=PULL_REQUEST_DIGEST_COMMENTS, on_progress=None):
+    # Run the steps missing from progress["steps"], then add the notes newer than progress["last_note_id"]
+    # progress ({"pull_request_number", "last_note_id", "steps"}) is updated and given to on_progress after each step and
+    # each posted comment: when an error is raised, it tells what is already on the pull request
+    repo = get_github_repo(github_token, repo_name)
+    pull_request_number = progress["pull_request_number"]
+
+    def step_done(step=None, last_note_id=None):
+        if step:
+            progress["steps"].append(step)
+        if last_note_id is not None:
+            progress["last_note_id"] = last_note_id
+        if on_progress:
+            on_progress(progress)
+
+    if PULL_REQUEST_STEP_REVIEWERS not in progress["steps"]:
+        # Request the review of all the reviewers at once
+        reviewer_usernames = get_reviewer_usernames(github_token, repo, merge_request_obj, org_members)
+        if reviewer_usernames:
+            response = github_request(github_token, "POST", f"{GITHUB_API_URL}/repos/{repo.full_name}/pulls/{pull_request_number}/requested_reviewers", json={"reviewers": reviewer_usernames})
+            response.raise_for_status()
+        step_done(PULL_REQUEST_STEP_REVIEWERS)
+
+    if PULL_REQUEST_STEP_ISSUE not in progress["steps"]:
+        # Assignee, labels and milestone are set with a single update of the pull request issue
+        issue_update = get_issue_update(github_token, repo, merge_request_obj, org_members)
+        if issue_update:
+            response = github_request(github_token, "PATCH", f"{GITHUB_API_URL}/repos/{repo.full_name}/issues/{pull_request_number}", json=issue_update)
+            response.raise_for_status()
+        step_done(PULL_REQUEST_STEP_ISSUE)
+
+    def add_comment(comment):
+        response = github_request(github_token, "POST", f"{GITHUB_API_URL}/repos/{repo.full_name}/issues/{pull_request_number}/comments", json={"body": comment[:MAX_COMMENT_LENGTH]})
+        response.raise_for_status()
+
+    comments, comment_ids = get_comments(merge_request_obj)
+    # Gitlab note ids grow with their creation: the notes already on the pull request are the ones up to last_note_id
+    new_notes = [(comment, comment_id) for comment, comment_id in zip(comments, comment_ids) if comment_id > progress["last_note_id"]]
+    first_number = len(comments) - len(new_notes) + 1
+
+    # Add Gitlab merge request urls as comment
+    last_comment = None
+    if PULL_REQUEST_STEP_URL_COMMENT not in progress["steps"]:
+        last_comment = f"Gitlab Merge Request URL: {merge_request_obj['url']}"
 
-def is_collaborator(repo, username):
+    if digest_comments:
+        # The comments and the Gitlab merge request url in as few comments as possible
+        for digest_comment, part_count in get_digest_comment_chunks([comment for comment, _ in new_notes], last_comment, first_number):
+            add_comment(digest_comment)
+            note_count = min(part_count, len(new_notes))
+            step_done(PULL_REQUEST_STEP_URL_COMMENT if part_count > len(new_notes) else None, new_notes[note_count - 1][1] if note_count else None)
+    else:
+        for comment, comment_id in new_notes:
+            # Add each comment as a separate issue comment, truncated to the GitHub size limit
+            add_comment(comment)
+            step_done(last_note_id=comment_id)
+        if last_comment:
+            add_comment(last_comment)
+            step_done(PULL_REQUEST_STEP_URL_COMMENT)
+
+
+def is_pull_request_complete(progress, merge_request_obj):
+    # All the steps are done and all the notes of the merge request are on the pull request
+    _, comment_ids = get_comments(merge_request_obj)
+    return set(PULL_REQUEST_STEPS) <= set(progress["steps"]) and progress["last_note_id"] >= max(comment_ids, default=0)
+
+
+def get_comments(merge_request_obj):
+    # (comments, Gitlab note ids) of the merge request, the ids are numbered from 1 when they are unknown
+    comments = merge_request_obj["comments"]
+    if not comments or comments == "None":
+        return [], []
+    return comments, merge_request_obj.get("comment_ids") or list(range(1, len(comments) + 1))
+
+
+def get_reviewer_usernames(github_token, repo, merge_request_obj, org_members):
+    reviewer_usernames = []
+    reviewers = merge_request_obj["reviewers"]
+    if reviewers and reviewers != []:
+        for reviewer in reviewers:
+
+            print(f"Reviewer: {reviewer}")
+            username = get_username_by_full_name(org_members, reviewer)
+            print(f"Username: {username}")                
+
+            if is_collaborator(github_token, repo, username):
+                if username not in reviewer_usernames:
+                    reviewer_usernames.append(username)
+            else:
+                print(f"Skipping reviewer {reviewer} as he is not a collaborator")
+    return reviewer_usernames
+
+
+def get_issue_update(github_token, repo, merge_request_obj, org_members):
+    # Assignee, labels and milestone of the pull request issue
+    issue_update = {}
+
+    assignee = merge_request_obj["assignee"]
+    if assignee and assignee != "None":
+
+        print(f"Assignee: {assignee}")
+        username = get_username_by_full_name(org_members, assignee)
+        print(f"Username: {username}")
+
+        if is_collaborator(github_token, repo, username):
+            issue_update["assignees"] = [username]
+        else:
+            print(f"Skipping assignee {assignee} as he is not a collaborator")
+
+    labels = get_label_names(merge_request_obj["labels"])
+    if labels:
+        issue_update["labels"] = labels
+
+    milestone = merge_request_obj["milestone"]
+    if milestone and milestone != "None":
+        milestone_number = get_milestone_numbers(github_token, repo).get(milestone)
+        if milestone_number:
+            issue_update["milestone"] = milestone_number
+        else:
+            print(f"Skipping milestone {milestone} as it does not exist in {repo.full_name}")
+    return issue_update
+
+
+def get_label_names(labels):
+    # Gitlab labels are a list, or a comma separated string
+    if not labels or labels == "None":
+        return []
+    if isinstance(labels, str):
+        labels = labels.split(',')
+    return [label.strip() for label in labels if label.strip()]
+
+
+def get_digest_comment_chunks(comments, last_comment=None, first_number=1):
+    # Gitlab comments separated by rules, split in several comments only when they exceed the GitHub size limit
+    # Returns (digest comment, number of parts in it and in the digest comments before it), the last comment is the last part
+    # A single note longer than the limit is truncated, every comment posted fits in MAX_COMMENT_LENGTH
+    parts = [f"**Gitlab comment {number}**\n\n{comment}"[:MAX_COMMENT_LENGTH] for number, comment in enumerate(comments, first_number)]
+    if last_comment:
+        parts.append(last_comment[:MAX_COMMENT_LENGTH])
+
+    digest_comments = []
+    digest_comment = ""
+    for part_count, part in enumerate(parts):
+        if digest_comment and len(digest_comment) + len(part) + len("\n\n---\n\n") > MAX_COMMENT_LENGTH:
+            digest_comments.append((digest_comment[:MAX_COMMENT_LENGTH], part_count))
+            digest_comment = ""
+        digest_comment = f"{digest_comment}\n\n---\n\n{part}" if digest_comment else part
+    if digest_comment:
+        digest_comments.append((digest_comment[:MAX_COMMENT_LENGTH], len(parts)))
+    return digest_comments
+
+
+# Repository handles and milestones, loaded once per token and repository
+# Their GET requests are revalidated against the conditional request cache: unchanged, they cost no rate limit
+github_repos = {}
+repo_milestones = {}
+github_repos_lock = threading.Lock()
+
+def get_github_repo(github_token, repo_name):
+    with github_repos_lock:
+        repo = github_repos.get((github_token, repo_name))
+    if repo is None:
+        repo = get_github_repository(github_token, repo_name)
+        with github_repos_lock:
+            repo = github_repos.setdefault((github_token, repo_name), repo)
+    return repo
+
+
+def get_milestone_numbers(github_token, repo):
+    # {milestone title: milestone number} of the repository
+    with github_repos_lock:
+        milestone_numbers = repo_milestones.get((github_token, repo.full_name))
+    if milestone_numbers is None:
+        milestone_numbers = load_milestone_numbers(github_token, repo.full_name)
+        with github_repos_lock:
+            milestone_numbers = repo_milestones.setdefault((github_token, repo.full_name), milestone_numbers)
+    return milestone_numbers
+
+
+def load_milestone_numbers(github_token, repo_full_name):
+    # Read all the pages of milestones (open and closed)
+    milestone_numbers = {}
+    page = 1
+    while True:
+        response = github_get(github_token, f"{GITHUB_API_URL}/repos/{repo_full_name}/milestones", params={"state": "all", "per_page": MILESTONES_PAGE_SIZE, "page": page})
+        response.raise_for_status()
+        milestones = response.json()
+        milestone_numbers.update((milestone["title"], milestone["number"]) for milestone in milestones)
+        if len(milestones) < MILESTONES_PAGE_SIZE:
+            return milestone_numbers
+        page += 1
+
+
+def is_collaborator(github_token, repo, username):
     """
     Check if a user is a collaborator of a GitHub repository.
     """
-    collaborators = repo.get_collaborators()
-    for collaborator in collaborators:
-        if collaborator.login == username:
-            return True
-    return False
+    # The collaborators of the repository are loaded once and shared by all the pull requests
+    return get_collaborator_cache(github_token).is_collaborator(repo.full_name, username)
+
+
+def load_collaborator_logins(github_token, repo_full_name):
+    # Read all the pages of collaborators, each page is revalidated against the conditional request cache
+    collaborator_logins = set()
+    page = 1
+    while True:
+        response = github_get(github_token, f"{GITHUB_API_URL}/repos/{repo_full_name}/collaborators", params={"per_page": COLLABORATORS_PAGE_SIZE, "page": page})
+        response.raise_for_status()
+        collaborators = response.json()
+        # GitHub logins are case insensitive
+        collaborator_logins.update(collaborator["login"].lower() for collaborator in collaborators)
+        if len(collaborators) < COLLABORATORS_PAGE_SIZE:
+            return collaborator_logins
+        page += 1
+
+
+class CollaboratorCache:
+    # Collaborator logins of each repository, kept in memory for ttl seconds
+
+    def __init__(self, github_token, ttl=GITHUB_COLLABORATORS_TTL):
+        self.github_token = github_token
+        self.ttl = ttl
+        self.collaborators = {}
+        self.repo_locks = {}
+        self.lock = threading.Lock()
+
+    def get_fresh_collaborators(self, repo_full_name):
+        with self.lock:
+            entry = self.collaborators.get(repo_full_name)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def get_collaborators(self, repo_full_name):
+        collaborator_logins = self.get_fresh_collaborators(repo_full_name)
+        if collaborator_logins is not None:
+            return collaborator_logins
+
+        # Only one thread loads the collaborators of a repository, the other ones wait for its result
+        with self.lock:
+            repo_lock = self.repo_locks.setdefault(repo_full_name, threading.Lock())
+        with repo_lock:
+            collaborator_logins = self.get_fresh_collaborators(repo_full_name)
+            if collaborator_logins is None:
+                collaborator_logins = load_collaborator_logins(self.github_token, repo_full_name)
+                with self.lock:
+                    self.collaborators[repo_full_name] = (time.monotonic(), collaborator_logins)
+            return collaborator_logins
+
+    def is_collaborator(self, repo_full_name, username):
+        return bool(username) and username.lower() in self.get_collaborators(repo_full_name)
+
+
+# One collaborator cache per token for the whole process
+collaborator_caches = {}
+collaborator_caches_lock = threading.Lock()
+
+def get_collaborator_cache(github_token):
+    with collaborator_caches_lock:
+        cache = collaborator_caches.get(github_token)
+        if cache is None:
+            cache = CollaboratorCache(github_token)
+            collaborator_caches[github_token] = cache
+        return cache
 
 
 # def get_github_username(github, full_name):
@@ -113,36 +370,60 @@ def is_collaborator(repo, username):
 #     return None  # Return None if the member is not found
 
 
-def get_username_by_full_name(members_list, user_full_name):
-    try:
-        if user_full_name:
-            for member in members_list:
-                if member["full_name"].lower() == user_full_name.lower():
-                    return member["user_name"]
-        return None  # Return None if the member is not found
-    except Exception as e:
-        return None
+def get_username_by_full_name(member_directory, user_full_name):
+    # member_directory is the MemberDirectory of the organization (see get_member_directory)
+    # Return None if the member is not found
+    return member_directory.get_username(user_full_name)
 
 
 def get_organization_members(organization_name, github_token):
-    # Authenticate to GitHub
-    g = Github(github_token)
-    
-    # Get the organization
-    org = g.get_organization(organization_name)
-    
-    # Initialize an empty list to store member details
+    # The REST list of members has no name, reading member.name costs one more request per member:
+    # the GraphQL query returns the login and the name of 100 members per request
     members_list = []
-    
-    # Get the members of the organization and create a list of dictionaries
-    for member in org.get_members():
-        member_details = {
-            "full_name": member.name,
-            "user_name": member.login
-        }
-        members_list.append(member_details)
-    
-    return members_list
+    cursor = None
+    while True:
+        answer = github_graphql(github_token, ORGANIZATION_MEMBERS_QUERY, {"organization": organization_name, "cursor": cursor})
+        if answer.get("errors"):
+            raise Exception(f"Failed to list the members of {organization_name}: {answer['errors'][0].get('message', 'unknown error')}")
+        members = answer["data"]["organization"]["membersWithRole"]
+
+        # Create a list of dictionaries
+        for member in members["nodes"]:
+            member_details = {
+                "full_name": member["name"],
+                "user_name": member["login"]
+            }
+            members_list.append(member_details)
+
+        if not members["pageInfo"]["hasNextPage"]:
+            return members_list
+        cursor = members["pageInfo"]["endCursor"]
+
+
+# One member directory per organization for the whole process
+member_directories = {}
+member_directories_lock = threading.Lock()
+
+def get_member_directory(organization_name, github_token, members_file_path=None):
+    # Member directory of the organization, built once from members_file_path (members-list.txt) when given,
+    # otherwise from the directory saved by a previous run if it is less than MEMBER_DIRECTORY_MAX_AGE seconds old,
+    # otherwise from the organization members on GitHub
+    with member_directories_lock:
+        member_directory = member_directories.get(organization_name)
+        if member_directory is not None:
+            return member_directory
+
+        directory_file_path = os.path.join(MEMBER_DIRECTORY_CACHE_DIRECTORY, f"{organization_name}.json")
+        if members_file_path:
+            member_directory = MemberDirectory.from_members_file(members_file_path)
+        elif os.path.exists(directory_file_path) and time.time() - os.path.getmtime(directory_file_path) < MEMBER_DIRECTORY_MAX_AGE:
+            member_directory = MemberDirectory.load(directory_file_path)
+        else:
+            member_directory = MemberDirectory(get_organization_members(organization_name, github_token))
+            os.makedirs(MEMBER_DIRECTORY_CACHE_DIRECTORY, exist_ok=True)
+            member_directory.save(directory_file_path)
+        member_directories[organization_name] = member_directory
+        return member_directory
 
 
 
@@ -157,9 +438,9 @@ def main():
     organization_name = "ae-organization"
 
 
-    org_members = get_organization_members(organization_name, github_token)
+    org_members = get_member_directory(organization_name, github_token)
 
-    print(f"Members: {org_members}")
+    print(f"Members: {len(org_members)}")
 
     mr_url = "https://gitlab.com/symphony-cloud/symphony-local/charge-station-gen3/charger/-/merge_requests/55"
     mr_id = "55"
@@ -176,6 +457,7 @@ def main():
     time_estimate = "0h"
     time_spent = "0h"
     mr_comments = ['Test comment 1', 'Test comment 2', 'Test comment 3']
+    mr_comment_ids = [1, 2, 3]
 
 
     # Create a merge request object
@@ -194,13 +476,16 @@ def main():
         "milestone": milestone,
         "time_estimate": time_estimate,
         "total_time_spent": time_spent,
-        "comments": mr_comments
+        "comments": mr_comments,
+        "comment_ids": mr_comment_ids
     }   
 
-    pull_request_url = create_github_pull_request(github_token, organization_name, repo_name, merge_request_obj, org_members)
+    pull_request_url, error_message = create_github_pull_request(github_token, organization_name, repo_name, merge_request_obj, org_members)
 
-    if pull_request_url:
+    if pull_request_url and not error_message:
         print(f"Pull request was successfully created : {pull_request_url}")
+    elif pull_request_url:
+        print(f"Pull request was created but not completed : {pull_request_url}")
     else:
         print("Failed to create pull request")
 
@@ -0,0 +1,55 @@
+import hashlib
+import threading
+import yaml
+from url_rewriter import normalize_repository_url
+
+# Use the C YAML loader (libyaml) when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
+
+
+class DevopsServiceIndex:
+    # Parsed CI/CD config file with an index: normalized repository url -> names of the ado_pipelines services building it
+
+    def __init__(self, file_content):
+        self.data = yaml.load(file_content, Loader=YamlSafeLoader) or {}
+        self.services_by_repository_url = {}
+
+        for service_name, service_info in (self.data.get('ado_pipelines') or {}).items():
+            if not isinstance(service_info, dict):
+                continue
+            for build_step in service_info.get('build') or []:
+                if isinstance(build_step, dict) and build_step.get('repository'):
+                    repository_url = normalize_repository_url(str(build_step['repository']))
+                    service_names = self.services_by_repository_url.setdefault(repository_url, [])
+                    if service_name not in service_names:
+                        service_names.append(service_name)
+
+    def get_service_names(self, repository_url):
+        return list(self.services_by_repository_url.get(normalize_repository_url(repository_url), []))
+
+    def get_repository_urls(self):
+        return list(self.services_by_repository_url)
+
+
+# Indexes already built, keyed by the sha of the file content
+MAX_CACHED_INDEXES = 8
+cached_indexes = {}
+cached_indexes_lock = threading.Lock()
+
+def get_devops_service_index(file_content, file_sha=None):
+    # The index of a given file version is built only once, file_sha is the Github blob sha when known
+    if file_sha is None:
+        file_sha = hashlib.sha1(file_content.encode("utf-8")).hexdigest()
+
+    with cached_indexes_lock:
+        index = cached_indexes.get(file_sha)
+    if index is None:
+        index = DevopsServiceIndex(file_content)
+        with cached_indexes_lock:
+            if len(cached_indexes) >= MAX_CACHED_INDEXES:
+                cached_indexes.pop(next(iter(cached_indexes)))
+            cached_indexes[file_sha] = index
+    return index
@@ -1,5 +1,6 @@
 import getpass
 from github import Github
+from create_pull_request import get_member_directory
 
 def get_github_username(github_token, full_name, organization_name):
     g = Github(github_token)
@@ -11,22 +12,12 @@ def get_github_username(github_token, full_name, organization_name):
 
 
 
-def get_username_by_full_name(github_token, member_full_name, organization_name):
-    # Authenticate to GitHub
-    g = Github(github_token)
-    
-    # Get the organization
-    org = g.get_organization(organization_name)
-    
-    # Get the members of the organization
-    members = org.get_members()
-    
+def get_username_by_full_name(github_token, member_full_name, organization_name, members_file_path=None):
+    # The member directory of the organization is built once, then every lookup is a dictionary access
+    member_directory = get_member_directory(organization_name, github_token, members_file_path)
+
     # Search for the member by full name and return their username
-    for member in members:
-        if member.name == member_full_name:
-            return member.login
-    
-    return None  # Return None if the member is not found
+    return member_directory.get_username(member_full_name)  # None if the member is not found
 
 # Example usage
 def main():
@@ -40,8 +31,7 @@ def main():
     for user in users:
         print("****************************************")
         print(f"User: {user}")
-        username = get_username_by_full_name(github_token, user, organization_name)^$
-        *
+        username = get_username_by_full_name(github_token, user, organization_name, "members-list.txt")
         print(f"Username: {username}")
 
 
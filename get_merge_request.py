@@ -1,17 +1,96 @@
 import gitlab
 import os
+import time
 import getpass
+from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import create_rate_limited_session, get_rate_limit_scheduler
 from dotenv import load_dotenv
 
+# Number of merge requests whose details (time stats, notes) are fetched at the same time
+GITLAB_HYDRATION_WORKERS = int(os.getenv("GITLAB_HYDRATION_WORKERS", 8))
 
-def get_merge_requests_for_private_project(gitlab_url, gitlab_token, project_name_with_namespace):
-    merge_requests_list = []  # Create a list to store merge request objects
 
+def get_merge_request_object(merge_request):
+    # Fetch the details of the merge request (time stats and all its notes) and build the merge request object
+    mr_url = merge_request.web_url
+    mr_id = merge_request.iid
+    mr_title = merge_request.title
+    mr_description = merge_request.description
+    mr_status = merge_request.state
+    is_drafted = merge_request.work_in_progress
+    source_branch = merge_request.source_branch
+    target_branch = merge_request.target_branch
+    assignee = merge_request.assignee["name"] if merge_request.assignee else "None"
+    reviewers = [reviewer["name"] for reviewer in merge_request.reviewers] if merge_request.reviewers else []
+    # TODO verify why some mr labels are printed "N,o,n,e" and not "None"
+    labels = merge_request.labels if merge_request.labels else []
+    milestone = merge_request.milestone["title"] if merge_request.milestone else "None"
+    # TODO: Verify the existence of Time Tracking in GitLab Merge Requests
+    time_stats = merge_request.time_stats()
+    time_tracking = {
+        "time_estimate": time_stats["time_estimate"],
+        "total_time_spent": time_stats["total_time_spent"]
+    }
+    # All the pages of notes, the oldest one first
+    notes = list(merge_request.notes.list(iterator=True, per_page=100, sort="asc", order_by="created_at"))
+    mr_comments = [f"{note.body}" for note in notes]
+
+    # Create a merge request object
+    return {
+        "url": mr_url,
+        "id": mr_id,
+        "title": mr_title,
+        "description": mr_description,
+        "status": mr_status,
+        "is_drafted": is_drafted,
+        "source_branch": source_branch,
+        "target_branch": target_branch,
+        "assignee": assignee,
+        "reviewers": reviewers,
+        "labels": labels,
+        "milestone": milestone,
+        "time_estimate": time_tracking["time_estimate"],
+        "total_time_spent": time_tracking["total_time_spent"],
+        "comments": mr_comments,
+        # Ids of the notes, to only add the new ones to the pull request in a later sync
+        "comment_ids": [note.id for note in notes]
+    }
+
+
+def hydrate_merge_request(merge_request):
+    # Worker task: the merge request object, or a failure marker (see is_failed_merge_request) when its details could not be fetched
+    try:
+        return get_merge_request_object(merge_request)
+    except Exception as e:
+        print(f"An error occurred while fetching merge request {merge_request.iid}: {str(e)}")
+        return {"id": merge_request.iid, "url": merge_request.web_url, "error_message": str(e)}
+
+
+def is_failed_merge_request(merge_request_obj):
+    # The details of the merge request could not be fetched, it has to be read again by the next run
+    return "error_message" in merge_request_obj
+
+
+def iter_merge_requests_for_private_project(gitlab_url, gitlab_token, project_name_with_namespace, max_workers=GITLAB_HYDRATION_WORKERS, updated_after=None):
+    # Yield the merge request objects in their listing order, as soon as their details are fetched
+    # A merge request whose details could not be fetched is yielded as a failure marker (see is_failed_merge_request),
+    # an error while listing the merge requests is raised to the caller
+    # updated_after (ISO 8601): only the merge requests updated since then
+    # The pages of merge requests are read while the details are fetched, at most 2 * max_workers merge requests are in flight
     print("Connecting to Gitlab")
 
+    gitlab_host = urlparse(gitlab_url).hostname
+    scheduler = get_rate_limit_scheduler(gitlab_host)
+    start_requests = scheduler.get_stats()["requests"]
+    start_time = time.monotonic()
+    merge_request_count = 0
+
     try:
-        # Step 1: Create a Gitlab API client
-        gl = gitlab.Gitlab(gitlab_url, private_token=gitlab_token)
+        # Step 1: Create a Gitlab API client, its requests go through the rate limit scheduler of the Gitlab host
+        # The connection pool is as large as the number of hydration workers
+        gl = gitlab.Gitlab(gitlab_url, private_token=gitlab_token, session=create_rate_limited_session(gitlab_host, max(10, max_workers)))
         
         # Authenticate with the Gitlab API
         gl.auth()
@@ -20,70 +99,35 @@ def get_merge_requests_for_private_project(gitlab_url, gitlab_token, project_nam
         project = gl.projects.get(project_name_with_namespace)
 
         print(f"Fetching merge requests for project: {project.name}")
-                
+
         # Get merge requests for the project with pagination
         # The project.mergerequests.list() function gets only the last 20 merge requests due to the default pagination behavior of the GitLab API
-        page = 1
-        merge_requests = []
-        while True:
-            page_merge_requests = project.mergerequests.list(state='opened', page=page, per_page=100)  # Adjust per_page as needed
-            if not page_merge_requests:
-                break
-            merge_requests.extend(page_merge_requests)
-            page += 1
-
-        # Create a text file for each project
-        for merge_request in merge_requests:
-            mr_url = merge_request.web_url
-            mr_id = merge_request.iid
-            mr_title = merge_request.title
-            mr_description = merge_request.description
-            mr_status = merge_request.state
-            is_drafted = merge_request.work_in_progress
-            source_branch = merge_request.source_branch
-            target_branch = merge_request.target_branch
-            assignee = merge_request.assignee["name"] if merge_request.assignee else "None"
-            reviewers = [reviewer["name"] for reviewer in merge_request.reviewers] if merge_request.reviewers else []
-            # TODO verify why some mr labels are printed "N,o,n,e" and not "None"
-            labels = merge_request.labels if merge_request.labels else []
-            milestone = merge_request.milestone["title"] if merge_request.milestone else "None"
-            # TODO: Verify the existence of Time Tracking in GitLab Merge Requests
-            time_tracking = {
-                "time_estimate": merge_request.time_stats()["time_estimate"],
-                "total_time_spent": merge_request.time_stats()["total_time_spent"]
-            }
-            mr_comments = []
-            notes_list = merge_request.notes.list()
-            if notes_list:
-                for note in notes_list:
-                    # mr_comments.append(f"{note.body}")
-                    mr_comments.insert(0, f"{note.body}") 
-             
-
-            # Create a merge request object
-            merge_request_obj = {
-                "url": mr_url,
-                "id": mr_id,
-                "title": mr_title,
-                "description": mr_description,
-                "status": mr_status,
-                "is_drafted": is_drafted,
-                "source_branch": source_branch,
-                "target_branch": target_branch,
-                "assignee": assignee,
-                "reviewers": reviewers,
-                "labels": labels,
-                "milestone": milestone,
-                "time_estimate": time_tracking["time_estimate"],
-                "total_time_spent": time_tracking["total_time_spent"],
-                "comments": mr_comments
-            }            
-            merge_requests_list.append(merge_request_obj)
-    
+        list_filters = {"updated_after": updated_after} if updated_after else {}
+        pending_merge_requests = deque()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="merge-request") as executor:
+            for merge_request in project.mergerequests.list(state='opened', iterator=True, per_page=100, **list_filters):  # Adjust per_page as needed
+                pending_merge_requests.append(executor.submit(hydrate_merge_request, merge_request))
+                while pending_merge_requests and (len(pending_merge_requests) >= 2 * max_workers or pending_merge_requests[0].done()):
+                    merge_request_count += 1
+                    yield pending_merge_requests.popleft().result()
+
+            while pending_merge_requests:
+                merge_request_count += 1
+                yield pending_merge_requests.popleft().result()
+
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-    
-    return merge_requests_list
+        # The caller must not take the listing for complete
+        raise
+
+    requests_count = scheduler.get_stats()["requests"] - start_requests
+    print(f"Fetched {merge_request_count} merge requests in {time.monotonic() - start_time:.1f}s ({requests_count} requests, {max_workers} workers)")
+
+
+def get_merge_requests_for_private_project(gitlab_url, gitlab_token, project_name_with_namespace, max_workers=GITLAB_HYDRATION_WORKERS):
+    # List of all the merge request objects, the ones whose details could not be fetched are left out
+    merge_requests = iter_merge_requests_for_private_project(gitlab_url, gitlab_token, project_name_with_namespace, max_workers)
+    return [merge_request_obj for merge_request_obj in merge_requests if not is_failed_merge_request(merge_request_obj)]
 
 # Example usage
 def main():
@@ -0,0 +1,116 @@
+import stat
+from io import BytesIO
+from gitdb import IStream
+from git.objects import Blob, Tree, Commit
+from git.objects.fun import tree_to_stream
+from git.remote import PushInfo
+
+
+# Helpers working directly on the git object database: no checkout, no working tree, no index file
+
+
+def list_tree_blobs(git_repo, commit, file_name):
+    # Return the blobs named file_name anywhere in the tree of the commit, from a single "git ls-tree" listing
+    blobs = []
+    tree_listing = git_repo.git.ls_tree("-r", "-z", "--full-tree", commit.hexsha)
+    for entry in tree_listing.split("\0"):
+        if not entry:
+            continue
+        entry_info, path = entry.split("\t", 1)
+        mode, object_type, hexsha = entry_info.split()
+        if object_type == Blob.type and (path == file_name or path.endswith("/" + file_name)):
+            blobs.append(Blob(git_repo, bytes.fromhex(hexsha), int(mode, 8), path))
+    return blobs
+
+
+def is_partial_clone(git_repo):
+    # A partial clone (--filter) only downloads the content of the blobs it reads
+    with git_repo.config_reader() as config:
+        return bool(config.get_value('remote "origin"', "promisor", False))
+
+
+def fetch_blobs(git_repo, blobs, batch_size=500):
+    # Download the content of the blobs of a partial clone with one request per batch_size blobs,
+    # instead of the one request per blob of the lazy fetches
+    blob_hexshas = sorted({blob.hexsha for blob in blobs})
+    git_command = git_repo.git(c="fetch.negotiationAlgorithm=noop")
+    for batch_start in range(0, len(blob_hexshas), batch_size):
+        git_command.fetch("--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "origin", *blob_hexshas[batch_start:batch_start + batch_size])
+
+
+def store_blob(git_repo, content):
+    # Write the content as a blob object and return its binary sha
+    istream = git_repo.odb.store(IStream(Blob.type, len(content), BytesIO(content)))
+    return istream.binsha
+
+
+def tree_entry_sort_key(entry):
+    # Git sorts the entries of a tree by name, the name of a sub tree being compared as "name/"
+    binsha, mode, name = entry
+    if stat.S_ISDIR(mode):
+        name = name + "/"
+    return name.encode("utf-8")
+
+
+def write_tree_with_blobs(git_repo, tree, blobs_by_path):
+    # Write a copy of the tree where each path of blobs_by_path ({path: (binsha, mode)}) points to the new blob
+    # Only the trees on the way to the updated paths are rewritten, the other entries are reused as is
+    entries = {item.name: (item.binsha, item.mode) for item in tree}
+
+    blobs_by_sub_tree = {}
+    for path, blob_entry in blobs_by_path.items():
+        name, _, sub_path = path.partition("/")
+        if sub_path:
+            blobs_by_sub_tree.setdefault(name, {})[sub_path] = blob_entry
+        else:
+            entries[name] = blob_entry
+
+    for name, sub_tree_blobs in blobs_by_sub_tree.items():
+        sub_tree = tree / name
+        updated_sub_tree = write_tree_with_blobs(git_repo, sub_tree, sub_tree_blobs)
+        entries[name] = (updated_sub_tree.binsha, sub_tree.mode)
+
+    tree_entries = sorted(((binsha, mode, name) for name, (binsha, mode) in entries.items()), key=tree_entry_sort_key)
+    tree_stream = BytesIO()
+    tree_to_stream(tree_entries, tree_stream.write)
+    tree_content = tree_stream.getvalue()
+
+    istream = git_repo.odb.store(IStream(Tree.type, len(tree_content), BytesIO(tree_content)))
+    return Tree(git_repo, istream.binsha, mode=tree.mode, path=tree.path)
+
+
+def commit_tree(git_repo, tree, message, parent_commit):
+    # Create a commit of the tree on top of parent_commit, without moving any branch
+    return Commit.create_from_tree(git_repo, tree, message, parent_commits=[parent_commit], head=False)
+
+
+def update_branch_ref(git_repo, branch_name, new_commit, old_commit):
+    # Move the branch only if it still points to old_commit
+    git_repo.git.update_ref(f"refs/heads/{branch_name}", new_commit.hexsha, old_commit.hexsha)
+
+
+PUSH_ERROR_FLAGS = PushInfo.ERROR | PushInfo.REJECTED | PushInfo.REMOTE_REJECTED | PushInfo.REMOTE_FAILURE
+
+def push_branches(git_repo, branch_names, atomic=False):
+    # Push all the branches to origin in a single "git push" with one refspec per branch
+    # With atomic, the remote updates either all the branches or none of them
+    # Returns {branch_name: error_summary} for the branches that were not pushed
+    if not branch_names:
+        return {}
+
+    refspecs = [f"refs/heads/{branch_name}:refs/heads/{branch_name}" for branch_name in branch_names]
+    push_infos = git_repo.remotes.origin.push(refspecs, atomic=atomic)
+
+    push_errors = {}
+    reported_branches = set()
+    for push_info in push_infos:
+        branch_name = push_info.remote_ref_string.replace("refs/heads/", "", 1)
+        reported_branches.add(branch_name)
+        if push_info.flags & PUSH_ERROR_FLAGS:
+            push_errors[branch_name] = push_info.summary.strip()
+
+    # A failed push can end before reporting every ref
+    for branch_name in branch_names:
+        if branch_name not in reported_branches:
+            push_errors[branch_name] = str(push_infos.error) if push_infos.error else "no push result"
+    return push_errors
@@ -0,0 +1,183 @@
+import os
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+import requests
+from urllib.parse import quote
+from github import Github
+from github.Repository import Repository
+from rate_limiter import RateLimitedAdapter, get_rate_limit_scheduler
+
+GITHUB_API_HOST = "api.github.com"
+GITHUB_API_URL = f"https://{GITHUB_API_HOST}"
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+# Number of kept-alive connections per host, shared by all the workers using the same token
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", 16))
+
+# Directory of the ETag / Last-Modified cache of the GET requests
+GITHUB_HTTP_CACHE_DIRECTORY = os.getenv("GITHUB_HTTP_CACHE_DIR", ".github_http_cache")
+
+
+# One pooled session and one PyGithub client per token
+github_sessions = {}
+github_clients = {}
+github_clients_lock = threading.Lock()
+
+def get_github_session(github_token):
+    with github_clients_lock:
+        session = github_sessions.get(github_token)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({
+                'Authorization': f'token {github_token}',
+                'Accept': 'application/vnd.github.v3+json',
+                'Accept-Encoding': 'gzip, deflate',
+            })
+            # Every request goes through the rate limit scheduler of the GitHub API
+            adapter = RateLimitedAdapter(get_rate_limit_scheduler(GITHUB_API_HOST), pool_connections=GITHUB_POOL_SIZE, pool_maxsize=GITHUB_POOL_SIZE)
+            session.mount("https://", adapter)
+            github_sessions[github_token] = session
+        return session
+
+
+def get_github_client(github_token):
+    with github_clients_lock:
+        client = github_clients.get(github_token)
+        if client is None:
+            # The pace of the requests is handled by the rate limit scheduler (see github_call), not per client
+            # No retry inside PyGithub: the rate limited answers must reach the scheduler, which pauses all the workers
+            client = Github(github_token, pool_size=GITHUB_POOL_SIZE, seconds_between_requests=None, seconds_between_writes=None, retry=None)
+            github_clients[github_token] = client
+        return client
+
+
+def github_call(github_token, function, *args, write=False, **kwargs):
+    # Run a PyGithub call through the rate limit scheduler of the GitHub API
+    # write=True for the calls creating or updating something, they are paced by the scheduler
+    scheduler = get_rate_limit_scheduler(GITHUB_API_HOST)
+    result = scheduler.call(function, *args, write=write, **kwargs)
+
+    # PyGithub keeps the budget of the last answer
+    client = get_github_client(github_token)
+    remaining, limit = client.requester.rate_limiting
+    if limit >= 0:
+        scheduler.update_from_headers({
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Reset": str(client.requester.rate_limiting_resettime),
+        })
+    return result
+
+
+class ConditionalRequestCache:
+    # Responses of the GET requests saved on disk with their validators (ETag, Last-Modified)
+    # A 304 Not Modified answer is not counted in the GitHub rate limit and the cached body is served instead
+
+    def __init__(self, cache_directory):
+        self.cache_directory = cache_directory
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def get_cache_file_path(self, github_token, url, params):
+        # The token is part of the key: two tokens may not see the same content
+        key = json.dumps([hashlib.sha256(github_token.encode("utf-8")).hexdigest(), url, sorted((params or {}).items())])
+        return os.path.join(self.cache_directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, github_token, url, params):
+        try:
+            with open(self.get_cache_file_path(github_token, url, params), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, github_token, url, params, response):
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "status_code": response.status_code,
+            "content": response.content.decode("utf-8"),
+        }
+        cache_file_path = self.get_cache_file_path(github_token, url, params)
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        file_descriptor, temporary_file_path = tempfile.mkstemp(dir=self.cache_directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(entry, file)
+        os.replace(temporary_file_path, cache_file_path)
+
+
+conditional_request_caches = {}
+
+def get_conditional_request_cache(cache_directory=GITHUB_HTTP_CACHE_DIRECTORY):
+    with github_clients_lock:
+        cache = conditional_request_caches.get(cache_directory)
+        if cache is None:
+            cache = ConditionalRequestCache(cache_directory)
+            conditional_request_caches[cache_directory] = cache
+        return cache
+
+
+def github_get(github_token, url, params=None):
+    # GET through the pooled session, revalidating the cached response when there is one
+    # response.from_cache is True when the body comes from the cache (304 Not Modified)
+    session = get_github_session(github_token)
+    cache = get_conditional_request_cache()
+    entry = cache.load(github_token, url, params)
+
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = session.get(url, params=params, headers=headers)
+    response.from_cache = False
+    if response.status_code == 304 and entry:
+        response.status_code = entry["status_code"]
+        response._content = entry["content"].encode("utf-8")
+        response.from_cache = True
+    elif response.status_code == 200 and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+        cache.save(github_token, url, params, response)
+    return response
+
+
+def github_request(github_token, method, url, **kwargs):
+    # Any other request through the pooled session
+    return get_github_session(github_token).request(method, url, **kwargs)
+
+
+def github_graphql(github_token, query, variables=None):
+    # Run a GraphQL query or mutation, returns the decoded answer ({"data": ..., "errors": [...]})
+    response = github_request(github_token, "POST", GITHUB_GRAPHQL_URL, json={"query": query, "variables": variables or {}})
+    response.raise_for_status()
+    return response.json()
+
+
+def get_github_repository(github_token, repo_full_name):
+    # PyGithub repository built from a GET revalidated against the conditional request cache
+    response = github_get(github_token, f"{GITHUB_API_URL}/repos/{repo_full_name}")
+    response.raise_for_status()
+    return get_github_client(github_token).create_from_raw_data(Repository, response.json(), dict(response.headers))
+
+
+def get_repository_file(github_token, repo_full_name, file_path, branch_name):
+    # Decoded content and blob sha of a file on a branch, revalidated against the conditional request cache
+    response = github_get(github_token, f"{GITHUB_API_URL}/repos/{repo_full_name}/contents/{quote(file_path)}", params={"ref": branch_name})
+    response.raise_for_status()
+    file = response.json()
+    return base64.b64decode(file["content"]).decode("utf-8"), file["sha"]
+
+
+def update_repository_file(github_token, repo_full_name, file_path, branch_name, content, sha, message):
+    # Commit the new content of a file on a branch, returns the sha of the new blob
+    response = github_request(github_token, "PUT", f"{GITHUB_API_URL}/repos/{repo_full_name}/contents/{quote(file_path)}", json={
+        "message": message,
+        "content": base64.b64encode(content.encode("utf-8")).decode("ascii"),
+        "sha": sha,
+        "branch": branch_name,
+    })
+    response.raise_for_status()
+    return response.json()["content"]["sha"]
@@ -1,4 +1,4 @@
-import requests
+from github_client import GITHUB_API_URL, github_get, github_request, github_graphql
 
 def rename_github_repo(owner, repo_name, github_token, new_name):
     had_error = False
@@ -13,24 +13,18 @@ def rename_github_repo(owner, repo_name, github_token, new_name):
             new_github_url = f'https://github.com/{owner}/{repo_name}.git'
         else:
             # Construct the API URLs
-            repo_exists_url = f'https://api.github.com/repos/{owner}/{repo_name}'
-            rename_repo_url = f'https://api.github.com/repos/{owner}/{repo_name}'
+            repo_exists_url = f'{GITHUB_API_URL}/repos/{owner}/{repo_name}'
+            rename_repo_url = f'{GITHUB_API_URL}/repos/{owner}/{repo_name}'
 
-            # Set up headers with the GitHub token
-            headers = {
-                'Authorization': f'token {github_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-
-            # Check if the repository exists
-            response = requests.get(repo_exists_url, headers=headers)
+            # Check if the repository exists (a cached answer is revalidated with a conditional request)
+            response = github_get(github_token, repo_exists_url)
 
             if response.status_code == 200:
                 # Repository exists, proceed to rename
                 data = {
                     "name": new_name
                 }
-                response = requests.patch(rename_repo_url, headers=headers, json=data)
+                response = github_request(github_token, "PATCH", rename_repo_url, json=data)
 
                 if response.status_code == 200:
                     print(f"Repository {owner}/{repo_name} has been renamed to {owner}/{new_name}")
@@ -54,6 +48,98 @@ def rename_github_repo(owner, repo_name, github_token, new_name):
         return had_error, error_message, response_message, new_github_url
 
 
+def get_graphql_alias_errors(answer, ignored_types=()):
+    # GraphQL errors of an aliased request, keyed by alias, without the errors of the ignored types (e.g. NOT_FOUND)
+    alias_errors = {}
+    for error in answer.get("errors") or []:
+        path = error.get("path") or []
+        if path and error.get("type") not in ignored_types:
+            alias_errors.setdefault(path[0], error.get("message", "unknown error"))
+    return alias_errors
+
+
+def get_graphql_error_message(answer):
+    # All the errors of a GraphQL answer, for an answer without data (rate limit, missing token scope...)
+    return "; ".join(error.get("message", "unknown error") for error in answer.get("errors") or []) or "no data"
+
+
+def rename_github_repos(owner, renames, github_token, batch_size=50):
+    # Rename many repositories with aliased GraphQL requests: one query for the repository ids and one mutation per batch
+    # renames is a list of (repo_name, new_name)
+    # Returns {repo_name: (had_error, error_message, response_message, new_github_url)}, the rename_github_repo contract
+    results = {}
+
+    pending_renames = []
+    for repo_name, new_name in renames:
+        if repo_name == new_name:
+            print(f"Ignore renaming repo {owner}/{repo_name}")
+            results[repo_name] = (False, "", f"Ignore renaming repo {owner}/{repo_name} \n", f'https://github.com/{owner}/{repo_name}.git')
+        else:
+            pending_renames.append((repo_name, new_name))
+
+    for batch_start in range(0, len(pending_renames), batch_size):
+        batch = pending_renames[batch_start:batch_start + batch_size]
+        print(f"Renaming {len(batch)} repositories in one GraphQL request")
+        try:
+            # Get the ids of the repositories
+            variables = {"owner": owner}
+            variables.update({f"name{index}": repo_name for index, (repo_name, _) in enumerate(batch)})
+            query = "query($owner: String!, " + ", ".join(f"$name{index}: String!" for index in range(len(batch))) + ") {\n"
+            query += "\n".join(f"  r{index}: repository(owner: $owner, name: $name{index}) {{ id }}" for index in range(len(batch)))
+            query += "\n}"
+            answer = github_graphql(github_token, query, variables)
+            if answer.get("data") is None:
+                # The whole query failed: the repositories are not known to be missing
+                raise Exception(f"Failed to get the repository ids. Error: {get_graphql_error_message(answer)}")
+            repositories = answer["data"]
+            # A repository that does not exist is a NOT_FOUND error, any other error fails its rename
+            alias_errors = get_graphql_alias_errors(answer, ignored_types=("NOT_FOUND",))
+
+            renamable = []
+            for index, (repo_name, new_name) in enumerate(batch):
+                if repositories.get(f"r{index}"):
+                    renamable.append((index, repo_name, new_name, repositories[f"r{index}"]["id"]))
+                elif f"r{index}" in alias_errors:
+                    print(f"Failed to get the repository {owner}/{repo_name}: {alias_errors[f'r{index}']}")
+                    results[repo_name] = (True, f"Failed to get the repository. Error: {alias_errors[f'r{index}']} \n", "", "")
+                else:
+                    print(f"Repository {owner}/{repo_name} does not exist or you do not have permission to access it.")
+                    results[repo_name] = (True, f"Repository {owner}/{repo_name} does not exist or you do not have permission to access it. \n", "", "")
+            if not renamable:
+                continue
+
+            # Rename all the existing repositories at once
+            variables = {}
+            for index, repo_name, new_name, repository_id in renamable:
+                variables[f"id{index}"] = repository_id
+                variables[f"newName{index}"] = new_name
+            mutation = "mutation(" + ", ".join(f"$id{index}: ID!, $newName{index}: String!" for index, _, _, _ in renamable) + ") {\n"
+            mutation += "\n".join(f"  r{index}: updateRepository(input: {{repositoryId: $id{index}, name: $newName{index}}}) {{ repository {{ name }} }}" for index, _, _, _ in renamable)
+            mutation += "\n}"
+            answer = github_graphql(github_token, mutation, variables)
+            if answer.get("data") is None:
+                raise Exception(f"Failed to rename the repositories. Error: {get_graphql_error_message(answer)}")
+            renamed_repositories = answer["data"]
+            alias_errors = get_graphql_alias_errors(answer)
+
+            for index, repo_name, new_name, _ in renamable:
+                if renamed_repositories.get(f"r{index}"):
+                    print(f"Repository {owner}/{repo_name} has been renamed to {owner}/{new_name}")
+                    results[repo_name] = (False, "", f"Repository {owner}/{repo_name} has been renamed to {owner}/{new_name} \n", f'https://github.com/{owner}/{new_name}.git')
+                else:
+                    error = alias_errors.get(f"r{index}", "no result")
+                    print(f"Failed to rename the repository {owner}/{repo_name}: {error}")
+                    results[repo_name] = (True, f"Failed to rename the repository. Error: {error} \n", "", "")
+
+        except Exception as e:
+            print(f"***rename_github_repos*** An unexpected error occurred: {e}")
+            for repo_name, _ in batch:
+                if repo_name not in results:
+                    results[repo_name] = (True, f"===> An unexpected error occurred: {e} \n", "", "")
+
+    return results
+
+
 # Example usage
 def main():
     github_repo_url = 'https://github.com/a-ellouze/b2c-tde-bridge.git'
@@ -1,7 +1,14 @@
-from utils import get_project_list
-from github_operations import rename_github_repo
-from replace_url_operations import update_scm_connections_in_maven_repositories, update_azure_devops_services
+from utils import get_project_list, append_lines_to_file, configure_host_limits, host_slot
+from url_rewriter import strip_git_suffix
+from rate_limiter import get_rate_limit_stats, format_rate_limit_stats
+from github_operations import rename_github_repo, rename_github_repos
+from replace_url_operations import update_scm_connections_in_maven_repositories, update_azure_devops_services, update_azure_devops_services_batch
+from mirror_cache import MirrorCache
+from checkpoint_journal import CheckpointJournal, STEP_RENAME, STEP_POM, STEP_DEVOPS, STEP_DONE, STEP_FAILED, get_pom_branch_step
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+import threading
+import argparse
 import logging
 import getpass
 import gitlab
@@ -10,9 +17,228 @@ import time
 import sys
 import os
 
+# Hosts used by the refactoring steps
+GITHUB_API_HOST = "api.github.com"
+GIT_TRANSPORT_HOST = "github.com"
+
+# The CI/CD config file is shared by all the projects, only one project at a time can edit it
+devops_file_lock = threading.Lock()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Rename GitHub repositories and replace their Gitlab urls")
+    parser.add_argument("--workers", type=int, default=1, help="Number of projects refactored at the same time (default: 1)")
+    parser.add_argument("--batch-devops", action="store_true", help="Update the CI/CD config file once for all the projects at the end of the run")
+    parser.add_argument("--devops-commits", type=int, default=1, help="Number of commits used to update the CI/CD config file in batch mode (default: 1)")
+    parser.add_argument("--checkout-free", action="store_true", help="Rewrite the pom.xml files in the git object database instead of checking out every branch")
+    parser.add_argument("--pom-workers", type=int, default=None, help="Number of processes rewriting the pom.xml files of a repository (default: number of CPUs)")
+    parser.add_argument("--branch-workers", type=int, default=1, help="Number of branches of a repository checked out and updated at the same time, each in its own git worktree (default: 1, ignored with --checkout-free)")
+    parser.add_argument("--atomic-push", action="store_true", help="Push the updated branches of a repository atomically (all or none)")
+    parser.add_argument("--rename-batch-size", type=int, default=0, help="Rename the repositories beforehand with batched GraphQL requests of this size (default: 0, one REST rename per project)")
+    parser.add_argument("--partial-fetch", action="store_true", help="Clone without history nor file contents, only the pom.xml files of the branch tips are downloaded")
+    parser.add_argument("--mirror-cache", action="store_true", help="Clone the repositories from local bare mirrors kept between runs (MIRROR_CACHE_DIR, MIRROR_CACHE_MAX_SIZE_MB)")
+    parser.add_argument("--journal", default="refactoring_journal.db", help="SQLite file recording the finished steps of every project (default: refactoring_journal.db)")
+    parser.add_argument("--resume", action="store_true", help="Skip the steps the journal records as done, only retry the failed or missing ones")
+    return parser.parse_args()
+
+
+def get_repo_name(github_repo_url):
+    # Extract the current repository name from the GitHub URL
+    return github_repo_url.split('/')[-1].replace(".git", "")
+
+
+def is_step_done(settings, project, step):
+    # Finished steps are only skipped in resume mode
+    return settings["resume"] and settings["journal"].is_step_done(project["old_gitlab_repo_url"], step)
+
+
+def record_step(settings, project, step, had_error, detail=""):
+    settings["journal"].record_step(project["old_gitlab_repo_url"], step, STEP_FAILED if had_error else STEP_DONE, detail)
+
+
+def refactor_project(project, settings, output_files, batch_devops=False, rename_result=None):
+    # Returns the project result, or None when the repository could not be renamed
+    # In batch mode, Step 3 is left to update_devops_file_in_batch and the outcome is not recorded yet
+    # rename_result is the result of rename_github_repos when the repositories were renamed beforehand
+    had_issue = False
+
+    print("########################################### Project ###########################################")
+    old_gitlab_repo_url = project["old_gitlab_repo_url"]
+    github_repo_url = project["github_repo_url"]
+    new_repo_name = project["new_repo_name"]
+
+
+    print(f"Old Gitlab Repo URL: {old_gitlab_repo_url}")
+    print(f"Github Repo URL: {github_repo_url}")
+    print(f"New Repo Name: {new_repo_name}")
+
+
+    logging.info(f'########################################### {new_repo_name} ###########################################')
+    logging.info(f'Old Gitlab Repo URL: {old_gitlab_repo_url}')
+    logging.info(f'Github Repo URL: {github_repo_url}')
+
+
+
+    # Step 1: Rename projects
+    logging.info('*************** Step 1: Renaming Github Repo ***************')
+    print('*************** Step 1: Renaming Github Repo ***************')
+
+    # Extract the current repository name from the GitHub URL
+    repo_name = get_repo_name(github_repo_url)
+    logging.info(f'Current Repo Name: {repo_name}')
+    logging.info(f'New Repo Name: {new_repo_name}')
+    if is_step_done(settings, project, STEP_RENAME):
+        # The journal keeps the url of the renamed repository
+        had_error, error_message = False, ""
+        new_github_repo_url = settings["journal"].get_step(old_gitlab_repo_url, STEP_RENAME)[1]
+        response_message = "Repository was already renamed by a previous run"
+    elif rename_result is None:
+        with host_slot(GITHUB_API_HOST):
+            had_error, error_message, response_message, new_github_repo_url = rename_github_repo(settings["github_org_name"], repo_name, settings["github_token"], new_repo_name)
+    else:
+        had_error, error_message, response_message, new_github_repo_url = rename_result
+    record_step(settings, project, STEP_RENAME, had_error, error_message if had_error else new_github_repo_url)
+    if had_error:
+        print(f"Error in renaming Github repo: {error_message}")
+        logging.error(f"==> Error in renaming Github repo: {error_message}")
+        # Add the project URL to the list of failed refactoring projects.
+        append_lines_to_file(output_files["failed"], [old_gitlab_repo_url + '\t' + github_repo_url + '\t' + new_repo_name])
+        return None
+    else:
+        print(f"{response_message}")
+        print(f"New Repo URL: {new_github_repo_url}")
+        logging.info(f'{response_message}')
+        logging.info(f'New Repo URL: {new_github_repo_url}')
+
+
+    # Step 2: Change repository URL inside pom.xml file and commit the changes
+    logging.info(f'*************** Step 2: Update pom.xml files if exists ***************')
+    print('*************** Step 2: Update pom.xml files if exists ***************')
+
+    github_project_path_segment = "/".join([settings["github_org_name"], new_repo_name])
+
+    logging.info(f'Github Project Path Segment: {github_project_path_segment}')
+    print(f"Github Project Path Segment: {github_project_path_segment}")
+
+    if is_step_done(settings, project, STEP_POM):
+        print("pom.xml files were already updated by a previous run")
+        had_error, error_message = False, ""
+    else:
+        # Branches updated by a previous run are skipped, the other ones are journaled as soon as they are pushed
+        skipped_branches = settings["journal"].get_done_pom_branches(old_gitlab_repo_url) if settings["resume"] else set()
+        on_branch_done = lambda branch_name: settings["journal"].record_step(old_gitlab_repo_url, get_pom_branch_step(branch_name), STEP_DONE)
+        with host_slot(GIT_TRANSPORT_HOST):
+            had_error, error_message = update_scm_connections_in_maven_repositories(new_github_repo_url, settings["github_token"], github_project_path_segment, settings["checkout_free"], settings["pom_workers"], settings["atomic_push"], skipped_branches, on_branch_done, settings["mirror_cache"], [github_repo_url], settings["partial_fetch"], settings["branch_workers"])
+        record_step(settings, project, STEP_POM, had_error, error_message)
+    if had_error:
+        logging.error(error_message)
+        had_issue = True
+    else:
+        logging.info(f'SCM connections were successfully updated in the pom files')
+
+
+    result = {
+        "project": project,
+        "repo_name": repo_name,
+        "new_github_repo_url": new_github_repo_url,
+        # Remove the ".git" suffix from the Url
+        "old_repo_url": strip_git_suffix(old_gitlab_repo_url),
+        "new_repo_url": strip_git_suffix(new_github_repo_url),
+        "had_issue": had_issue,
+    }
+    if batch_devops:
+        return result
+
+    # Step 3: Change repository URL inside the CI/CD project
+    logging.info(f'*************** Step 3: Change repository URL inside the CI/CD project***************')
+    print('*************** Step 3: Change repository URL inside the CI/CD project***************')
+
+    old_repo_url = result["old_repo_url"]
+    new_repo_url = result["new_repo_url"]
+    logging.info(f'Old Gitlab Repo URL: {old_repo_url}')
+    logging.info(f'New Github Repo URL: {new_repo_url}')
+
+    if is_step_done(settings, project, STEP_DEVOPS):
+        print("CI/CD config file was already updated by a previous run")
+        logging.info(f'Repository URL was already updated in the CI/CD config File by a previous run')
+        record_project_outcome(result, output_files)
+        return result
+
+    with devops_file_lock, host_slot(GITHUB_API_HOST):
+        had_error, error_message, changed_services = update_azure_devops_services (settings["github_devops_repo_url"], settings["github_token"], settings["github_devops_repo_branch_name"], settings["github_devops_repo_file_path"], old_repo_url, new_repo_url)
+    record_step(settings, project, STEP_DEVOPS, had_error, error_message)
+    record_devops_update(result, had_error, error_message, changed_services, output_files)
+    record_project_outcome(result, output_files)
+    return result
+
+
+def record_devops_update(result, had_error, error_message, changed_services, output_files):
+    if had_error:
+        logging.error(error_message)
+        result["had_issue"] = True
+    else:
+        logging.info(f'Repository URL was successfully updated in the CI/CD config File')
+        logging.info(f'AZ Devops services updated are: {changed_services}')
+
+    if changed_services:
+        # Save updated services of infra-as-code project
+        append_lines_to_file(output_files["az_services"], changed_services)
+
+
+def record_project_outcome(result, output_files):
+    old_gitlab_repo_url = result["project"]["old_gitlab_repo_url"]
+    new_repo_name = result["project"]["new_repo_name"]
+    repo_name = result["repo_name"]
+    new_github_repo_url = result["new_github_repo_url"]
+
+    if result["had_issue"]:
+        print(f"{repo_name} has been renamed but encountered some issues in updating Urls!!")
+        logging.warning(f'Warning!! {repo_name} has been renamed but encountered some issues')
+        # Add the project URL to the list of partial success migration projects.
+        append_lines_to_file(output_files["partial_success"], [old_gitlab_repo_url + '\t' + new_github_repo_url + '\t' + new_repo_name])
+    else :
+        print(f"{repo_name} has been successfully refactored")
+        logging.info(f'{repo_name} has been successfully refactored')
+        # Add the project URL to the list of successful migration projects.
+        append_lines_to_file(output_files["success"], [old_gitlab_repo_url + '\t' + new_github_repo_url + '\t' + new_repo_name])
+
+
+def update_devops_file_in_batch(results, settings, output_files, commits_count):
+    # Step 3 for all the renamed projects: the CI/CD config file is loaded once and committed in commits_count commits
+    logging.info(f'*************** Step 3: Change repository URLs inside the CI/CD project for {len(results)} projects ***************')
+    print(f'*************** Step 3: Change repository URLs inside the CI/CD project for {len(results)} projects ***************')
+
+    # Projects whose url was already replaced by a previous run are left out of the batch
+    pending_results = []
+    for result in results:
+        if is_step_done(settings, result["project"], STEP_DEVOPS):
+            logging.info(f'Repository URL of {result["repo_name"]} was already updated in the CI/CD config File by a previous run')
+            record_project_outcome(result, output_files)
+        else:
+            pending_results.append(result)
+    if not pending_results:
+        return
+
+    url_replacements = [(result["old_repo_url"], result["new_repo_url"]) for result in pending_results]
+    with host_slot(GITHUB_API_HOST):
+        had_error, error_message, devops_results = update_azure_devops_services_batch(settings["github_devops_repo_url"], settings["github_token"], settings["github_devops_repo_branch_name"], settings["github_devops_repo_file_path"], url_replacements, commits_count)
+    if had_error:
+        logging.error(error_message)
+
+    for result in pending_results:
+        logging.info(f'Old Gitlab Repo URL: {result["old_repo_url"]}')
+        logging.info(f'New Github Repo URL: {result["new_repo_url"]}')
+        project_had_error, project_error_message, changed_services = devops_results[result["old_repo_url"]]
+        record_step(settings, result["project"], STEP_DEVOPS, project_had_error, project_error_message)
+        record_devops_update(result, project_had_error, project_error_message, changed_services, output_files)
+        record_project_outcome(result, output_files)
+
+
 def main():
     print("RUNNING GITHUB-REPO-REFACTORER")
 
+    args = parse_arguments()
+
     # Load variables from .env file into environment variables
     load_dotenv()
     github_org_name = os.getenv("GITHUB_ORG_NAME")
@@ -33,11 +259,31 @@ def main():
     ):
         print("One or more environment variables are missing.")
         sys.exit(1)
-    try:
-        had_error = False
-        had_issue = False
-        error_message = ""
 
+    settings = {
+        "github_org_name": github_org_name,
+        "github_token": github_token,
+        "github_devops_repo_url": github_devops_repo_url,
+        "github_devops_repo_branch_name": github_devops_repo_branch_name,
+        "github_devops_repo_file_path": github_devops_repo_file_path,
+        "checkout_free": args.checkout_free,
+        "pom_workers": args.pom_workers,
+        "atomic_push": args.atomic_push,
+        "branch_workers": args.branch_workers,
+        "mirror_cache": MirrorCache() if args.mirror_cache else None,
+        "partial_fetch": args.partial_fetch,
+        # Steps already done are skipped in resume mode
+        "journal": CheckpointJournal(args.journal),
+        "resume": args.resume,
+    }
+
+    # Concurrency limits of each host, only used when several workers are running
+    configure_host_limits({
+        GITHUB_API_HOST: os.getenv("GITHUB_API_CONCURRENCY", 4),
+        GIT_TRANSPORT_HOST: os.getenv("GIT_TRANSPORT_CONCURRENCY", 4),
+    })
+
+    try:
         # Define the full path to the log file
         timestamp = time.strftime("%Y%m%d%H%M%S")
         output_directory = f"output_{timestamp}"
@@ -49,134 +295,70 @@ def main():
         log_filename = "my_log_file.log"
         log_file_path = os.path.join(output_directory, log_filename)
 
-        # Define the full path to the success refactoring file
-        sr_filename = "successful_refactoring.txt"
-        sr_file_path = os.path.join(output_directory, sr_filename)
-
-        # Define the full path to the failed refactoring file
-        fr_filename = "failed_refactoring.txt"
-        fr_file_path = os.path.join(output_directory, fr_filename)
-
-        # Define the full path to the failed refactoring file
-        warning_filename = "partial_success_refactoring.txt"
-        warning_file_path = os.path.join(output_directory, warning_filename)                
-
-        # Define the full path to the updated AZ Devops services
-        az_services_filename = "updated_az_devops_services.txt"
-        az_services_file_path = os.path.join(output_directory, az_services_filename) 
+        output_files = {
+            # Define the full path to the success refactoring file
+            "success": os.path.join(output_directory, "successful_refactoring.txt"),
+            # Define the full path to the failed refactoring file
+            "failed": os.path.join(output_directory, "failed_refactoring.txt"),
+            # Define the full path to the partial success refactoring file
+            "partial_success": os.path.join(output_directory, "partial_success_refactoring.txt"),
+            # Define the full path to the updated AZ Devops services
+            "az_services": os.path.join(output_directory, "updated_az_devops_services.txt"),
+        }
 
         # Create the output directory if it doesn't exist
         os.makedirs(output_directory, exist_ok=True)
 
-        # Configure logging
-        logging.basicConfig(filename=log_file_path, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s\n')
+        # Configure logging, the worker name tells which project a line belongs to
+        log_format = '%(asctime)s - %(levelname)s - %(message)s\n'
+        if args.workers > 1:
+            log_format = '%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s\n'
+        logging.basicConfig(filename=log_file_path, level=logging.INFO, format=log_format)
 
 
         # Get list of projects
         projects = get_project_list(project_list_file_path)
 
-        for project in projects:
-
-            print("########################################### Project ###########################################")
-            old_gitlab_repo_url = project["old_gitlab_repo_url"]
-            github_repo_url = project["github_repo_url"]
-            new_repo_name = project["new_repo_name"]
-
-
-            print(f"Old Gitlab Repo URL: {old_gitlab_repo_url}")
-            print(f"Github Repo URL: {github_repo_url}")
-            print(f"New Repo Name: {new_repo_name}")
-
-
-            logging.info(f'########################################### {new_repo_name} ###########################################')
-            logging.info(f'Old Gitlab Repo URL: {old_gitlab_repo_url}')
-            logging.info(f'Github Repo URL: {github_repo_url}')
-
-
-
-            # Step 1: Rename projects
-            logging.info('*************** Step 1: Renaming Github Repo ***************')
-            print('*************** Step 1: Renaming Github Repo ***************')
-
-            # Extract the current repository name from the GitHub URL
-            repo_name = github_repo_url.split('/')[-1].replace(".git", "")
-            logging.info(f'Current Repo Name: {repo_name}')
-            logging.info(f'New Repo Name: {new_repo_name}')
-            had_error, error_message, response_message, new_github_repo_url = rename_github_repo(github_org_name, repo_name, github_token, new_repo_name)
-            if had_error:
-                print(f"Error in renaming Github repo: {error_message}")
-                logging.error(f"==> Error in renaming Github repo: {error_message}")
-                with open(fr_file_path, "a") as file:
-                    # Add the project URL to the list of failed refactoring projects.
-                    file.write(old_gitlab_repo_url + '\t' + github_repo_url + '\t' + new_repo_name + '\n')
-                continue
-            else:
-                print(f"{response_message}")
-                print(f"New Repo URL: {new_github_repo_url}")
-                logging.info(f'{response_message}')
-                logging.info(f'New Repo URL: {new_github_repo_url}')
-
-
-            # Step 2: Change repository URL inside pom.xml file and commit the changes
-            logging.info(f'*************** Step 2: Update pom.xml files if exists ***************')
-            print('*************** Step 2: Update pom.xml files if exists ***************')
-
-            github_project_path_segment = "/".join([github_org_name, new_repo_name])
-
-            logging.info(f'Github Project Path Segment: {github_project_path_segment}')
-            print(f"Github Project Path Segment: {github_project_path_segment}")
-
-            had_error, error_message = update_scm_connections_in_maven_repositories(new_github_repo_url, github_token, github_project_path_segment)
-            if had_error:
-                logging.error(error_message)
-                had_issue = True                          
-            else:
-                logging.info(f'SCM connections were successfully updated in the pom files')
-
-
-            # Step 3: Change repository URL inside the CI/CD project
-            logging.info(f'*************** Step 3: Change repository URL inside the CI/CD project***************')
-            print('*************** Step 3: Change repository URL inside the CI/CD project***************')
-
-            # Remove the ".git" from the Url
-            old_repo_url = old_gitlab_repo_url.replace('.git', '')
-            new_repo_url = new_github_repo_url.replace('.git', '')
-            logging.info(f'Old Gitlab Repo URL: {old_repo_url}')
-            logging.info(f'New Github Repo URL: {new_repo_url}')
-
-            had_error, error_message, changed_services = update_azure_devops_services (github_devops_repo_url, github_token, github_devops_repo_branch_name, github_devops_repo_file_path, old_repo_url, new_repo_url)
-            if had_error:
-                logging.error(error_message)
-                had_issue = True
-            else:
-                logging.info(f'Repository URL was successfully updated in the CI/CD config File')
-                logging.info(f'AZ Devops services updated are: {changed_services}')       
-
-            if changed_services:
-                with open(az_services_file_path, "a") as file:
-                    # Save updated services of infra-as-code project
-                    file.write('\n'.join(changed_services))                   
-                    file.write('\n')
-
-
-            if had_issue:
-                print(f"{repo_name} has been renamed but encountered some issues in updating Urls!!")
-                logging.warning(f'Warning!! {repo_name} has been renamed but encountered some issues')
-                with open(warning_file_path, "a") as file:
-                    # Add the project URL to the list of partial success migration projects.
-                    file.write(old_gitlab_repo_url + '\t' + new_github_repo_url + '\t' + new_repo_name + '\n')     
-            else :
-                print(f"{repo_name} has been successfully refactored")
-                logging.info(f'{repo_name} has been successfully refactored')
-                with open(sr_file_path, "a") as file:
-                    # Add the project URL to the list of successful migration projects.
-                    file.write(old_gitlab_repo_url + '\t' + new_github_repo_url + '\t' + new_repo_name + '\n')  
+        # Rename all the repositories at once with batched GraphQL requests
+        rename_results = {}
+        if args.rename_batch_size > 0:
+            renames = [(get_repo_name(project["github_repo_url"]), project["new_repo_name"]) for project in projects if not is_step_done(settings, project, STEP_RENAME)]
+            with host_slot(GITHUB_API_HOST):
+                rename_results = rename_github_repos(github_org_name, renames, github_token, args.rename_batch_size)
+
+        results = []
+        if args.workers > 1:
+            print(f"Refactoring {len(projects)} projects with {args.workers} workers")
+            with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="project") as executor:
+                futures = {executor.submit(refactor_project, project, settings, output_files, args.batch_devops, rename_results.get(get_repo_name(project["github_repo_url"]))): project for project in projects}
+                for future in as_completed(futures):
+                    project = futures[future]
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        print(f"An error occurred while refactoring {project['github_repo_url']}: {str(e)}")
+                        logging.error(f"==> An error occurred while refactoring {project['github_repo_url']}: {str(e)}")
+                        append_lines_to_file(output_files["failed"], [project["old_gitlab_repo_url"] + '\t' + project["github_repo_url"] + '\t' + project["new_repo_name"]])
+        else:
+            for project in projects:
+                results.append(refactor_project(project, settings, output_files, args.batch_devops, rename_results.get(get_repo_name(project["github_repo_url"]))))
+
+        # Renamed projects are waiting for the CI/CD config file update
+        renamed_results = [result for result in results if result]
+        if args.batch_devops and renamed_results:
+            update_devops_file_in_batch(renamed_results, settings, output_files, args.devops_commits)
+
+        # Throughput and remaining budget of each host
+        for stats in get_rate_limit_stats():
+            print(format_rate_limit_stats(stats))
+            logging.info(format_rate_limit_stats(stats))
 
 
 
 
         # Close the log file
         logging.shutdown()
+        settings["journal"].close()
 
     except ValueError as e:
         print("Error In parsing project-list file:", e)
@@ -0,0 +1,76 @@
+import os
+import csv
+import json
+import tempfile
+import unicodedata
+
+
+def normalize_full_name(full_name):
+    # "Ali  ELLOUZE" and "ali ellouzé" are the same person: case, accents and whitespace are ignored
+    if not full_name:
+        return ""
+    decomposed_name = unicodedata.normalize("NFKD", full_name)
+    name_without_accents = "".join(character for character in decomposed_name if not unicodedata.combining(character))
+    return " ".join(name_without_accents.casefold().split())
+
+
+class MemberDirectory:
+    # Members of a GitHub organization indexed by normalized full name and by login
+    # members is a list of {"full_name": ..., "user_name": ...}, the format of get_organization_members
+
+    def __init__(self, members=()):
+        self.members = []
+        self.members_by_name = {}
+        self.members_by_login = {}
+        for member in members:
+            self.add_member(member.get("full_name"), member.get("user_name"))
+
+    def add_member(self, full_name, user_name):
+        if not user_name:
+            return
+        member = {"full_name": full_name, "user_name": user_name}
+        self.members.append(member)
+        # GitHub logins are case insensitive
+        self.members_by_login[user_name.lower()] = member
+        name_key = normalize_full_name(full_name)
+        if name_key:
+            # Two members with the same name: the first one is kept
+            self.members_by_name.setdefault(name_key, member)
+
+    def get_username(self, full_name_or_login):
+        # Login of the member with this full name, the Gitlab name of a user may also be their GitHub login
+        if not full_name_or_login:
+            return None
+        member = self.members_by_name.get(normalize_full_name(full_name_or_login))
+        if member is None:
+            member = self.members_by_login.get(full_name_or_login.strip().lower())
+        return member["user_name"] if member else None
+
+    def get_member(self, user_name):
+        return self.members_by_login.get(user_name.lower()) if user_name else None
+
+    def __len__(self):
+        return len(self.members)
+
+    def save(self, file_path):
+        # Write to a temporary file first so that a reader never sees a partial directory
+        directory = os.path.dirname(os.path.abspath(file_path))
+        file_descriptor, temporary_file_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+            json.dump({"members": self.members}, file, ensure_ascii=False)
+        os.replace(temporary_file_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, "r", encoding="utf-8") as file:
+            return cls(json.load(file)["members"])
+
+    @classmethod
+    def from_members_file(cls, file_path):
+        # Read a members-list.txt file (Full_name, Username separated by a tab)
+        directory = cls()
+        with open(file_path, newline='', encoding="utf-8") as csvfile:
+            reader = csv.DictReader(csvfile, delimiter='\t')
+            for row in reader:
+                directory.add_member((row.get('Full_name') or '').strip(), (row.get('Username') or '').strip())
+        return directory
@@ -1,59 +1,287 @@
 import os
+import sys
+import json
+import time
 import gitlab
 import getpass
-from github import Github
+import argparse
+import threading
+import multiprocessing
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from get_merge_request import iter_merge_requests_for_private_project, is_failed_merge_request
+from create_pull_request import create_github_pull_request, complete_pull_request, is_pull_request_complete, get_member_directory, PULL_REQUEST_STEPS
+from rate_limiter import create_rate_limited_session, share_write_pace
+from spill_queue import SpillQueue
+from utils import get_project_list
+from url_rewriter import strip_git_suffix
+from checkpoint_journal import CheckpointJournal, STEP_MERGE_REQUEST_WATERMARK, STEP_DONE, STEP_FAILED, get_merge_request_step
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+# Number of pull requests created at the same time, their writes are paced by the rate limit scheduler
+PULL_REQUEST_WORKERS = int(os.getenv("PULL_REQUEST_WORKERS", 4))
+# Merge requests kept in memory while waiting for a pull request worker, the other ones wait on disk
+MERGE_REQUEST_QUEUE_SIZE = int(os.getenv("MERGE_REQUEST_QUEUE_SIZE", 100))
+MERGE_REQUEST_SPOOL_DIRECTORY = os.getenv("MERGE_REQUEST_SPOOL_DIR", "merge_request_spool")
 
 
-# Example usage
-def main():
+def print_merge_request(merge_request_obj):
+    print(f"******************************* Merge Request ID: {merge_request_obj['id']} *****************************************")
+    print(f"URL: {merge_request_obj['url']}")
+    print(f"Title: {merge_request_obj['title']}")
+    print(f"Description: {merge_request_obj['description']}")
+    print(f"Status: {merge_request_obj['status']}")
+    print(f"Is Drafted: {merge_request_obj['is_drafted']}")
+    print(f"Source Branch: {merge_request_obj['source_branch']}")
+    print(f"Target Branch: {merge_request_obj['target_branch']}")
+    print(f"Assignee: {merge_request_obj['assignee']}")
+    print(f"Reviewers: {', '.join(merge_request_obj['reviewers'])}")
+    print(f"Labels: {', '.join(merge_request_obj['labels'])}")
+    print(f"Milestone: {merge_request_obj['milestone']}")
+    print(f"Time Estimate: {merge_request_obj['time_estimate']}h")
+    print(f"Time Spent: {merge_request_obj['total_time_spent']}h")
+    print(f"Comments: {merge_request_obj['comments']}")
+    print("\n")
 
 
-    gitlab_url = "https://gitlab.com"
-    # gitlab_token = getpass.getpass("Enter your GITLAB_TOKEN: ")
-    load_dotenv()
-    gitlab_token = os.getenv("GITLAB_TOKEN")
-    github_token = os.getenv("GITHUB_TOKEN")
-    organization_name = os.getenv("GITHUB_ORG_NAME")
+def migrate_merge_requests(gitlab_url, gitlab_token, gitlab_project_name, github_token, organization_name, github_project_name, workers=PULL_REQUEST_WORKERS, journal=None, sync=False):
+    # The merge requests are streamed from Gitlab into a queue that the pull request workers drain at the same time
+    # journal records the pull request of each merge request and the time of the last complete run of the project
+    # sync: only the merge requests updated since that time are read, the already migrated ones only get their new notes
+    # (and the steps an interrupted run left undone)
+    # Returns the number of created pull requests, of updated ones and of failed ones
+    org_members = get_member_directory(organization_name, github_token)
+    project_key = f"{gitlab_url.rstrip('/')}/{gitlab_project_name}"
+
+    updated_after = None
+    if sync and journal:
+        watermark = journal.get_step(project_key, STEP_MERGE_REQUEST_WATERMARK)
+        updated_after = watermark[1] if watermark else None
+        print(f"Syncing the merge requests updated after: {updated_after or 'the beginning'}")
+    # Merge requests updated while this run lists them are read again by the next one
+    sync_started_at = datetime.now(timezone.utc).isoformat()
+
+    merge_request_queue = SpillQueue(MERGE_REQUEST_QUEUE_SIZE, MERGE_REQUEST_SPOOL_DIRECTORY)
+    counts = {"created": 0, "updated": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    def get_migrated_pull_request(merge_request_obj):
+        # Progress of the pull request already created for the merge request (see complete_pull_request), or None
+        if not (sync and journal):
+            return None
+        step = journal.get_step(project_key, get_merge_request_step(merge_request_obj["id"]))
+        if not step or not step[1]:
+            return None
+        progress = json.loads(step[1])
+        # The pull requests recorded without their steps were completed
+        progress.setdefault("steps", list(PULL_REQUEST_STEPS))
+        return progress
+
+    def record_pull_request(merge_request_obj, progress):
+        # Recorded as failed until the pull request is complete, the next sync completes it
+        if journal:
+            status = STEP_DONE if is_pull_request_complete(progress, merge_request_obj) else STEP_FAILED
+            journal.record_step(project_key, get_merge_request_step(merge_request_obj["id"]), status, json.dumps(progress))
+
+    def update_pull_request(merge_request_obj, progress):
+        # Run the steps an interrupted run left undone and add the notes written since the last run to the pull request
+        pull_request_number = progress["pull_request_number"]
+        if is_pull_request_complete(progress, merge_request_obj):
+            print(f"Merge request {merge_request_obj['id']} has no new note for pull request #{pull_request_number}")
+            return False
+        try:
+            complete_pull_request(github_token, github_project_name, merge_request_obj, org_members, progress, on_progress=lambda progress: record_pull_request(merge_request_obj, progress))
+        except Exception as e:
+            print(f"An error occurred while updating pull request #{pull_request_number} of merge request {merge_request_obj['id']}: {str(e)}")
+            return None
+        print(f"Updated pull request #{pull_request_number} of merge request {merge_request_obj['id']}")
+        return True
+
+    def create_pull_requests():
+        while True:
+            merge_request_obj = merge_request_queue.get()
+            if merge_request_obj is None:
+                return
 
+            migrated_pull_request = get_migrated_pull_request(merge_request_obj)
+            if migrated_pull_request:
+                updated = update_pull_request(merge_request_obj, migrated_pull_request)
+                with counts_lock:
+                    if updated is None:
+                        counts["failed"] += 1
+                    elif updated:
+                        counts["updated"] += 1
+                continue
 
-    # TODO recupare dynamic list of prject
-    gitlab_project_name = "symphony-cloud/symphony-local/charge-station-gen3/charger"
-    github_project_name = "ae-organization/charger"
+            print_merge_request(merge_request_obj)
 
-    # symphony-cloud/user-experience/guis/g2smart-angular
-    # symphony-cloud/infrastructure/core/infra-manager.git"
-    merge_requests = get_merge_requests_for_private_project(gitlab_url, gitlab_token, gitlab_project_name)
+            # The pull request is recorded as soon as it is created, then after each step: the next sync completes it
+            # instead of creating it again
+            pull_request_url, error_message = create_github_pull_request(github_token, organization_name, github_project_name, merge_request_obj, org_members,
+                on_progress=lambda progress: record_pull_request(merge_request_obj, progress))
 
-    org_members = get_organization_members(organization_name, github_token)
+            if pull_request_url and not error_message:
+                print(f"Pull request was successfully created : {pull_request_url}")
+            elif pull_request_url:
+                print(f"Pull request was created but not completed : {pull_request_url}")
+            else:
+                print("Failed to create pull request")
+            with counts_lock:
+                counts["failed" if error_message else "created"] += 1
 
     print("===> Merge Requests: ")
-    for merge_request_obj in merge_requests:
-        print(f"******************************* Merge Request ID: {merge_request_obj['id']} *****************************************")
-        print(f"URL: {merge_request_obj['url']}")
-        print(f"Title: {merge_request_obj['title']}")
-        print(f"Description: {merge_request_obj['description']}")
-        print(f"Status: {merge_request_obj['status']}")
-        print(f"Is Drafted: {merge_request_obj['is_drafted']}")
-        print(f"Source Branch: {merge_request_obj['source_branch']}")
-        print(f"Target Branch: {merge_request_obj['target_branch']}")
-        print(f"Assignee: {merge_request_obj['assignee']}")
-        print(f"Reviewers: {', '.join(merge_request_obj['reviewers'])}")
-        print(f"Labels: {', '.join(merge_request_obj['labels'])}")
-        print(f"Milestone: {merge_request_obj['milestone']}")
-        print(f"Time Estimate: {merge_request_obj['time_estimate']}h")
-        print(f"Time Spent: {merge_request_obj['total_time_spent']}h")
-        print(f"Comments: {merge_request_obj['comments']}")
-        print("\n")
-
-        pull_request_url = create_github_pull_request(github_token, organization_name, github_project_name, merge_request_obj, org_members)
-
-        if pull_request_url:
-            print(f"Pull request was successfully created : {pull_request_url}")
-        else:
-            print("Failed to create pull request")
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pull-request") as executor:
+            consumers = [executor.submit(create_pull_requests) for _ in range(workers)]
+            try:
+                for merge_request_obj in iter_merge_requests_for_private_project(gitlab_url, gitlab_token, gitlab_project_name, updated_after=updated_after):
+                    if is_failed_merge_request(merge_request_obj):
+                        # Its details could not be fetched, it is read again by the next run
+                        with counts_lock:
+                            counts["failed"] += 1
+                        continue
+                    merge_request_queue.put(merge_request_obj)
+            except Exception as e:
+                # The merge requests after the error were not listed: counted as one failure to hold the watermark back
+                print(f"===> An error occurred while listing the merge requests of {gitlab_project_name}: {str(e)}")
+                with counts_lock:
+                    counts["failed"] += 1
+            finally:
+                merge_request_queue.close()
+            for consumer in consumers:
+                consumer.result()
+    finally:
+        merge_request_queue.cleanup()
+
+    if merge_request_queue.spilled_count:
+        print(f"{merge_request_queue.spilled_count} merge requests waited on disk for a pull request worker")
+
+    # The next sync starts from this run, unless some merge requests must be tried again
+    if journal and not counts["failed"]:
+        journal.record_step(project_key, STEP_MERGE_REQUEST_WATERMARK, STEP_DONE, sync_started_at)
+    return counts["created"], counts["updated"], counts["failed"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Migrate the open Gitlab merge requests of many projects to GitHub pull requests")
+    parser.add_argument("--project-list", default=None, help="Project list file (Old_Gitlab_URL, Github_URL, New_Repo_Name), default: PROJECT_LIST_FILE_PATH")
+    parser.add_argument("--gitlab-group", default=None, help="Migrate every project of this Gitlab group and its subgroups, to the GitHub repository of the same name")
+    parser.add_argument("--gitlab-url", default="https://gitlab.com", help="Gitlab instance of --gitlab-group (default: https://gitlab.com)")
+    parser.add_argument("--processes", type=int, default=1, help="Number of projects migrated at the same time, one process each (default: 1)")
+    parser.add_argument("--workers", type=int, default=PULL_REQUEST_WORKERS, help=f"Number of pull requests created at the same time in a project (default: {PULL_REQUEST_WORKERS})")
+    parser.add_argument("--journal", default="merge_request_journal.db", help="SQLite file recording the pull request of each merge request and the last sync of each project (default: merge_request_journal.db)")
+    parser.add_argument("--sync", action="store_true", help="Only read the merge requests updated since the last run, add the new notes to the pull requests already created")
+    return parser.parse_args()
+
+
+def get_project_migrations(project_list_file_path):
+    # One migration per line of the project list: the Gitlab project and the renamed GitHub repository
+    migrations = []
+    for project in get_project_list(project_list_file_path):
+        gitlab_repo_url = urlparse(strip_git_suffix(project["old_gitlab_repo_url"]))
+        github_org_name = urlparse(project["github_repo_url"]).path.strip("/").split("/")[0]
+        migrations.append({
+            "gitlab_url": f"{gitlab_repo_url.scheme}://{gitlab_repo_url.netloc}",
+            "gitlab_project_name": gitlab_repo_url.path.strip("/"),
+            "github_project_name": f"{github_org_name}/{project['new_repo_name']}",
+        })
+    return migrations
+
+
+def get_group_migrations(gitlab_url, gitlab_token, group_name, github_org_name):
+    # One migration per project of the Gitlab group and its subgroups, to the GitHub repository of the same name
+    gl = gitlab.Gitlab(gitlab_url, private_token=gitlab_token, session=create_rate_limited_session(urlparse(gitlab_url).hostname))
+    group = gl.groups.get(group_name)
+    return [
+        {
+            "gitlab_url": gitlab_url,
+            "gitlab_project_name": group_project.path_with_namespace,
+            "github_project_name": f"{github_org_name}/{group_project.path}",
+        }
+        for group_project in group.projects.list(iterator=True, include_subgroups=True, archived=False, per_page=100)
+    ]
+
+
+def init_migration_process(process_count):
+    # The processes are spawned: each one has its own Gitlab and GitHub clients, sessions and caches, none of the
+    # pooled connections of the parent (opened to build the member directory) is shared
+    # The write pace of the hosts is split between the processes
+    share_write_pace(process_count)
+
+
+def migrate_project_merge_requests(migration, settings):
+    # Process pool task: migrate the merge requests of one project, returns the migration with its counts and duration
+    start_time = time.monotonic()
+    # Each process has its own connection to the journal
+    journal = CheckpointJournal(settings["journal"])
+    try:
+        created_count, updated_count, failed_count = migrate_merge_requests(migration["gitlab_url"], settings["gitlab_token"], migration["gitlab_project_name"], settings["github_token"], settings["github_org_name"], migration["github_project_name"], settings["workers"], journal, settings["sync"])
+        error_message = ""
+    except Exception as e:
+        created_count, updated_count, failed_count = 0, 0, 0
+        error_message = str(e)
+    finally:
+        journal.close()
+    return dict(migration, created=created_count, updated=updated_count, failed=failed_count, error_message=error_message, duration=time.monotonic() - start_time)
+
+
+def print_project_progress(result, done_count, total_count):
+    throughput = result["created"] / result["duration"] * 60 if result["duration"] else 0
+    print(f"===> [{done_count}/{total_count}] {result['gitlab_project_name']} -> {result['github_project_name']}: "
+          f"{result['created']} pull requests created, {result['updated']} updated, {result['failed']} failed in {result['duration']:.0f}s ({throughput:.1f} pull requests/min)")
+    if result["error_message"]:
+        print(f"===> An error occurred while migrating {result['gitlab_project_name']}: {result['error_message']}")
+
+
+def main():
+    args = parse_arguments()
+
+    # gitlab_token = getpass.getpass("Enter your GITLAB_TOKEN: ")
+    load_dotenv()
+    settings = {
+        "gitlab_token": os.getenv("GITLAB_TOKEN"),
+        "github_token": os.getenv("GITHUB_TOKEN"),
+        "github_org_name": os.getenv("GITHUB_ORG_NAME"),
+        "workers": args.workers,
+        "journal": args.journal,
+        "sync": args.sync,
+    }
+    if None in settings.values():
+        print("One or more environment variables are missing.")
+        sys.exit(1)
+
+    if args.gitlab_group:
+        migrations = get_group_migrations(args.gitlab_url, settings["gitlab_token"], args.gitlab_group, settings["github_org_name"])
+    else:
+        project_list_file_path = args.project_list or os.getenv("PROJECT_LIST_FILE_PATH")
+        if not project_list_file_path:
+            print("A project list file (--project-list or PROJECT_LIST_FILE_PATH) or a Gitlab group (--gitlab-group) is required.")
+            sys.exit(1)
+        migrations = get_project_migrations(project_list_file_path)
+
+    # Build the member directory once, the processes load the copy saved on disk
+    get_member_directory(settings["github_org_name"], settings["github_token"])
+
+    print(f"Migrating the merge requests of {len(migrations)} projects with {args.processes} processes")
+    start_time = time.monotonic()
+    results = []
+    if args.processes > 1:
+        with ProcessPoolExecutor(max_workers=args.processes, mp_context=multiprocessing.get_context("spawn"), initializer=init_migration_process, initargs=(args.processes,)) as executor:
+            futures = [executor.submit(migrate_project_merge_requests, migration, settings) for migration in migrations]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print_project_progress(results[-1], len(results), len(migrations))
+    else:
+        for migration in migrations:
+            results.append(migrate_project_merge_requests(migration, settings))
+            print_project_progress(results[-1], len(results), len(migrations))
+
+    created_count = sum(result["created"] for result in results)
+    updated_count = sum(result["updated"] for result in results)
+    failed_count = sum(result["failed"] for result in results)
+    print(f"{created_count} pull requests created, {updated_count} updated, {failed_count} failed in {time.monotonic() - start_time:.0f}s")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
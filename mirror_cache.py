@@ -0,0 +1,175 @@
+import os
+import git
+import glob
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from url_rewriter import normalize_repository_url
+
+# Directory of the bare mirrors kept between runs, and its size limit
+MIRROR_CACHE_DIRECTORY = os.getenv("MIRROR_CACHE_DIR", ".mirror_cache")
+MIRROR_CACHE_MAX_SIZE_MB = int(os.getenv("MIRROR_CACHE_MAX_SIZE_MB", 10240))
+
+MIRROR_FETCH_REFSPEC = "+refs/heads/*:refs/heads/*"
+INDEX_FILE_NAME = "index.json"
+# Mirrors being removed are moved to directories with this suffix, a run interrupted before deleting them leaves them behind
+REMOVED_DIRECTORY_SUFFIX = ".removed"
+
+
+def get_directory_size(directory):
+    size = 0
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            try:
+                size += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class MirrorCache:
+    # Bare mirrors of the GitHub repositories, refreshed with an incremental "git fetch --prune" before each use
+    # A mirror is known by all the urls its repository had: once a repository is renamed, a lookup with its
+    # previous url finds the mirror and records the new url
+    # When the cache is larger than max_size_mb, the least recently used mirrors that no clone is using are removed
+
+    def __init__(self, cache_directory=MIRROR_CACHE_DIRECTORY, max_size_mb=MIRROR_CACHE_MAX_SIZE_MB):
+        self.cache_directory = os.path.abspath(cache_directory)
+        self.max_size = max_size_mb * 1024 * 1024
+        os.makedirs(self.cache_directory, exist_ok=True)
+        self.index_path = os.path.join(self.cache_directory, INDEX_FILE_NAME)
+        self.index = self.load_index()
+        self.lock = threading.Lock()
+        self.mirror_locks = {}
+        # Number of clones using each mirror, a mirror in use is not removed
+        self.mirror_users = {}
+        self.remove_directories(glob.glob(os.path.join(self.cache_directory, f"*{REMOVED_DIRECTORY_SUFFIX}")))
+
+    def load_index(self):
+        # {mirror name: {"urls": [...], "last_used": timestamp, "size": bytes}}
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # The mirrors of an index written without their size are measured once
+        for mirror_name, mirror in index.items():
+            if "size" not in mirror:
+                mirror["size"] = get_directory_size(os.path.join(self.cache_directory, mirror_name))
+        return index
+
+    def save_index(self):
+        file_descriptor, temporary_file_path = tempfile.mkstemp(dir=self.cache_directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(temporary_file_path, self.index_path)
+
+    def acquire_mirror(self, repo_url, previous_urls=()):
+        # Name of the mirror of the repository, recording repo_url when the mirror was found with a previous url
+        # The mirror is counted as in use until release_mirror: it can not be removed in between
+        normalized_url = normalize_repository_url(repo_url)
+        normalized_previous_urls = [normalize_repository_url(url) for url in previous_urls]
+        with self.lock:
+            mirror_name = self.find_mirror_name(normalized_url, normalized_previous_urls)
+            if mirror_name is None:
+                repo_name = normalized_url.rstrip("/").split("/")[-1]
+                mirror_name = f"{repo_name}-{hashlib.sha1(normalized_url.encode('utf-8')).hexdigest()[:12]}.git"
+                self.index[mirror_name] = {"urls": [normalized_url] + normalized_previous_urls, "last_used": time.time(), "size": 0}
+                self.save_index()
+            self.mirror_users[mirror_name] = self.mirror_users.get(mirror_name, 0) + 1
+            return mirror_name
+
+    def find_mirror_name(self, normalized_url, normalized_previous_urls):
+        # Called with self.lock held
+        for candidate_url in [normalized_url] + normalized_previous_urls:
+            for mirror_name, mirror in self.index.items():
+                if candidate_url in mirror["urls"]:
+                    if normalized_url not in mirror["urls"]:
+                        mirror["urls"].append(normalized_url)
+                        self.save_index()
+                    return mirror_name
+        return None
+
+    def release_mirror(self, mirror_name):
+        with self.lock:
+            self.mirror_users[mirror_name] -= 1
+            if not self.mirror_users[mirror_name]:
+                del self.mirror_users[mirror_name]
+
+    def get_mirror_lock(self, mirror_name):
+        with self.lock:
+            return self.mirror_locks.setdefault(mirror_name, threading.Lock())
+
+    def update_mirror(self, mirror_path, repo_url, signed_url):
+        # Fetch only what changed since the last run, or create the mirror
+        if os.path.isdir(mirror_path):
+            try:
+                print(f" Fetching mirror: {mirror_path}")
+                mirror_repo = git.Repo(mirror_path)
+                mirror_repo.git.fetch("--prune", signed_url, MIRROR_FETCH_REFSPEC)
+                # The repository may have been renamed since the mirror was created
+                mirror_repo.remotes.origin.set_url(repo_url)
+                return
+            except git.exc.GitError as e:
+                # A broken mirror is cloned again
+                print(f" Mirror {mirror_path} could not be fetched, cloning it again: {e}")
+                shutil.rmtree(mirror_path, ignore_errors=True)
+
+        print(f" Cloning mirror: {mirror_path}")
+        mirror_repo = git.Repo.clone_from(signed_url, mirror_path, bare=True)
+        # The token is not kept in the mirror config
+        mirror_repo.remotes.origin.set_url(repo_url)
+
+    def clone(self, repo_url, signed_url, repo_dir, bare=False, previous_urls=()):
+        # Clone the repository into repo_dir from its up to date mirror, then point origin to GitHub
+        # A local clone hard links the objects of the mirror: only the changes since the last run go over the network
+        mirror_name = self.acquire_mirror(repo_url, previous_urls)
+        try:
+            mirror_path = os.path.join(self.cache_directory, mirror_name)
+            with self.get_mirror_lock(mirror_name):
+                self.update_mirror(mirror_path, repo_url, signed_url)
+                # Measured after each fetch, eviction reads the sizes from the index
+                mirror_size = get_directory_size(mirror_path)
+                git_repo = git.Repo.clone_from(mirror_path, repo_dir, bare=bare)
+            git_repo.remotes.origin.set_url(signed_url)
+
+            with self.lock:
+                mirror = self.index.setdefault(mirror_name, {"urls": [normalize_repository_url(repo_url)]})
+                mirror["last_used"] = time.time()
+                mirror["size"] = mirror_size
+                self.save_index()
+            self.evict()
+        finally:
+            self.release_mirror(mirror_name)
+        return git_repo
+
+    def evict(self):
+        # Remove the least recently used mirrors until the cache fits in its size limit
+        # The mirrors are chosen and moved aside under the lock, their files are deleted after it is released
+        removed_directories = []
+        with self.lock:
+            cache_size = sum(mirror.get("size", 0) for mirror in self.index.values())
+            for mirror_name in sorted(self.index, key=lambda name: self.index[name].get("last_used", 0)):
+                if cache_size <= self.max_size:
+                    break
+                if self.mirror_users.get(mirror_name):
+                    continue
+                print(f" Removing least recently used mirror: {mirror_name}")
+                mirror_path = os.path.join(self.cache_directory, mirror_name)
+                if os.path.isdir(mirror_path):
+                    # A new mirror of the same repository can be created while the old one is being deleted
+                    removed_directory = tempfile.mkdtemp(dir=self.cache_directory, suffix=REMOVED_DIRECTORY_SUFFIX)
+                    os.rename(mirror_path, os.path.join(removed_directory, mirror_name))
+                    removed_directories.append(removed_directory)
+                cache_size -= self.index[mirror_name].get("size", 0)
+                del self.index[mirror_name]
+            if removed_directories:
+                self.save_index()
+        self.remove_directories(removed_directories)
+
+    def remove_directories(self, directories):
+        for directory in directories:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,124 @@
+import re
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+# Children of the 'scm' element holding the repository urls, with the label printed when they are updated
+SCM_VALUE_LABELS = {
+    "connection": "Updated Connection:",
+    "developerConnection": "Updated Developer Connection:",
+    "url": "Updated URL:",
+}
+
+XML_DECLARATION_ENCODING_PATTERN = re.compile(rb'^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+# The new values are written as UTF-8, other encodings go through the full parse
+PATCHABLE_ENCODINGS = ("utf-8", "utf8", "us-ascii", "ascii")
+
+
+class UnsupportedPomError(Exception):
+    # The pom.xml file can not be patched in place, it has to go through the full parse
+    pass
+
+
+def get_start_tag_end(xml_content, tag_start):
+    # Offset following the '>' of the start tag beginning at tag_start, quoted attribute values may hold a '>'
+    quote = None
+    for position in range(tag_start, len(xml_content)):
+        character = xml_content[position]
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in (ord('"'), ord("'")):
+            quote = character
+        elif character == ord(">"):
+            if xml_content[position - 1] == ord("/"):
+                # <url/>: there is no text to replace
+                raise UnsupportedPomError("empty scm element")
+            return position + 1
+    raise UnsupportedPomError("unterminated start tag")
+
+
+def find_scm_value_ranges(xml_content, target_namespace):
+    # Stream the document and return whether it has an 'scm' element, and for the first connection, developerConnection
+    # and url elements of the first 'scm' element: {name: (text start offset, text end offset, text)}
+    # The whole document is read, a malformed one is left to the full parse
+    parser = expat.ParserCreate(namespace_separator=" ")
+    parser.buffer_text = True
+    scm_name = f"{target_namespace} scm"
+    value_names = {f"{target_namespace} {name}": name for name in SCM_VALUE_LABELS}
+
+    ranges = {}
+    state = {"depth": 0, "scm_depth": None, "scm_found": False, "value": None, "value_start": None, "value_depth": None, "text": []}
+
+    def start_element(name, attributes):
+        state["depth"] += 1
+        if state["value"] is not None:
+            raise UnsupportedPomError("element inside an scm value")
+        if state["scm_depth"] is None:
+            # Same element as the ".//ns:scm" lookup of the full parse: the first one below the root
+            if name == scm_name and not state["scm_found"] and state["depth"] > 1:
+                state["scm_depth"] = state["depth"]
+                state["scm_found"] = True
+        elif name in value_names and value_names[name] not in ranges:
+            state["value"] = value_names[name]
+            state["value_start"] = get_start_tag_end(xml_content, parser.CurrentByteIndex)
+            state["value_depth"] = state["depth"]
+            state["text"] = []
+
+    def end_element(name):
+        if state["value"] is not None and state["depth"] == state["value_depth"]:
+            ranges[state["value"]] = (state["value_start"], parser.CurrentByteIndex, "".join(state["text"]))
+            state["value"] = None
+        elif state["scm_depth"] == state["depth"]:
+            state["scm_depth"] = None
+        state["depth"] -= 1
+
+    def character_data(data):
+        if state["value"] is not None:
+            state["text"].append(data)
+
+    def unsupported_markup(*args):
+        if state["value"] is not None:
+            raise UnsupportedPomError("comment, CDATA or processing instruction inside an scm value")
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.CommentHandler = unsupported_markup
+    parser.StartCdataSectionHandler = unsupported_markup
+    parser.ProcessingInstructionHandler = unsupported_markup
+
+    try:
+        parser.Parse(xml_content, True)
+    except expat.ExpatError as e:
+        raise UnsupportedPomError(f"XML error: {str(e)}")
+    return state["scm_found"], ranges
+
+
+def patch_scm_connections(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url):
+    # Return the pom.xml content (bytes) with the new SCM values spliced in place of the old ones, or None when they are
+    # already up to date: the rest of the file (declaration, indentation, comments) is left untouched
+    # Raises UnsupportedPomError when the document has to go through the full parse
+    if xml_content[:2] in (b"\xff\xfe", b"\xfe\xff") or b"\x00" in xml_content[:4]:
+        raise UnsupportedPomError("UTF-16 or UTF-32 document")
+    encoding_match = XML_DECLARATION_ENCODING_PATTERN.match(xml_content)
+    if encoding_match and encoding_match.group(1).decode("ascii").lower() not in PATCHABLE_ENCODINGS:
+        raise UnsupportedPomError(f"{encoding_match.group(1).decode('ascii')} document")
+
+    scm_found, ranges = find_scm_value_ranges(xml_content, target_namespace)
+    if not scm_found:
+        raise UnsupportedPomError("no scm element")
+
+    new_values = {"connection": scm_connection, "developerConnection": scm_developer_connection, "url": scm_url}
+    if all(ranges[name][2].strip() == value for name, value in new_values.items() if name in ranges):
+        print("SCM connections are already up to date")
+        return None
+
+    parts = []
+    last_end = 0
+    for name, (start, end, _) in sorted(ranges.items(), key=lambda item: item[1][0]):
+        parts.append(xml_content[last_end:start])
+        parts.append(escape(new_values[name]).encode("utf-8"))
+        last_end = end
+        print(SCM_VALUE_LABELS[name], new_values[name])
+    parts.append(xml_content[last_end:])
+    return b"".join(parts)
@@ -0,0 +1,292 @@
+import os
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes used by GitHub (primary and secondary rate limits) and GitLab when a client goes too fast
+RATE_LIMIT_STATUS_CODES = (403, 429)
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# Default pace of the write requests per host kind, GitHub asks for at least one second between writes
+GITHUB_WRITES_PER_SECOND = float(os.getenv("GITHUB_WRITES_PER_SECOND", 1))
+GITLAB_WRITES_PER_SECOND = float(os.getenv("GITLAB_WRITES_PER_SECOND", 5))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+
+# Longest pause after a rate limited answer without Retry-After nor reset time
+MAX_BACKOFF_SECONDS = 900
+
+# GitHub counts the REST (core), search and GraphQL requests in separate budgets, named by the X-RateLimit-Resource header
+# GitLab has a single budget, recorded as the core one
+CORE_RESOURCE = "core"
+
+
+class TokenBucket:
+    # Blocking token bucket: acquire() returns once a token is available, tokens come back at `rate` per second
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def get_header(headers, *names):
+    # The headers of the PyGithub exceptions are a plain dict with lower case names
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            value = headers.get(name.lower())
+        if value is not None:
+            return value
+    return None
+
+
+def get_rate_limit_resource(url):
+    # Budget a GitHub API request is counted in
+    path = urlparse(url).path
+    if path.startswith("/graphql"):
+        return "graphql"
+    if path.startswith("/search/"):
+        return "search"
+    return CORE_RESOURCE
+
+
+class RateLimitScheduler:
+    # Request scheduler of one host, shared by all the threads talking to it:
+    # - reads the remaining budget from the GitHub (X-RateLimit-*) and GitLab (RateLimit-*) answer headers,
+    #   and waits for the reset when the budget is spent, each GitHub budget (core, search, graphql) on its own
+    # - paces the write requests with a token bucket
+    # - on a rate limited answer (403/429), pauses every request (Retry-After or exponential delay), or only the requests
+    #   of the spent budget until its reset time, and halves the write pace, which then goes back up step by step
+    #   after each successful request
+
+    def __init__(self, host, writes_per_second, max_retries=RATE_LIMIT_MAX_RETRIES):
+        self.host = host
+        self.max_writes_per_second = writes_per_second
+        self.writes_per_second = writes_per_second
+        self.write_bucket = TokenBucket(writes_per_second)
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+
+        # {resource: {"remaining": ..., "limit": ..., "reset_at": ...}}
+        self.budgets = {}
+        self.paused_until = 0
+        self.consecutive_backoffs = 0
+
+        self.request_count = 0
+        self.backoff_count = 0
+        self.recent_requests = deque()
+
+    def wait_for_slot(self, write=False, resource=CORE_RESOURCE):
+        while True:
+            with self.lock:
+                now = time.time()
+                wait_seconds = self.paused_until - now
+                budget = self.budgets.get(resource, {})
+                if budget.get("remaining") is not None and budget["remaining"] <= 0 and budget.get("reset_at") and budget["reset_at"] > now:
+                    wait_seconds = max(wait_seconds, budget["reset_at"] - now)
+            if wait_seconds <= 0:
+                break
+            print(f"Rate limit of {self.host}: waiting {wait_seconds:.0f}s")
+            time.sleep(min(wait_seconds, 60))
+
+        if write:
+            self.write_bucket.acquire()
+
+        with self.lock:
+            self.request_count += 1
+            self.recent_requests.append(time.monotonic())
+
+    def update_from_headers(self, headers):
+        if not headers:
+            return
+        remaining = get_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+        limit = get_header(headers, "X-RateLimit-Limit", "RateLimit-Limit")
+        reset_at = get_header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        resource = get_header(headers, "X-RateLimit-Resource") or CORE_RESOURCE
+        with self.lock:
+            budget = self.budgets.setdefault(resource, {})
+            try:
+                if remaining is not None:
+                    budget["remaining"] = int(remaining)
+                if limit is not None:
+                    budget["limit"] = int(limit)
+                if reset_at is not None:
+                    budget["reset_at"] = int(reset_at)
+            except ValueError:
+                pass
+
+    def is_rate_limited(self, status_code, headers, message=""):
+        # A 403 is also the answer to a missing permission, only the rate limit ones are retried
+        if status_code == 429:
+            return True
+        if status_code != 403:
+            return False
+        headers = headers or {}
+        if get_header(headers, "Retry-After") is not None:
+            return True
+        if get_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining") == "0":
+            return True
+        return "rate limit" in (message or "").lower()
+
+    def back_off(self, headers):
+        headers = headers or {}
+        with self.lock:
+            self.consecutive_backoffs += 1
+            self.backoff_count += 1
+
+            retry_after = get_header(headers, "Retry-After")
+            reset_at = get_header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+            remaining = get_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+            if retry_after is not None and retry_after.isdigit():
+                delay = int(retry_after)
+                self.paused_until = max(self.paused_until, time.time() + delay)
+            elif remaining == "0" and reset_at is not None and reset_at.isdigit():
+                # A spent budget (recorded by update_from_headers) only holds the requests of its resource back
+                delay = max(1, int(reset_at) - time.time())
+            else:
+                delay = min(MAX_BACKOFF_SECONDS, 5 * 2 ** (self.consecutive_backoffs - 1))
+                self.paused_until = max(self.paused_until, time.time() + delay)
+
+            # Multiplicative decrease of the write pace
+            self.writes_per_second = max(self.max_writes_per_second / 32, self.writes_per_second / 2)
+            self.write_bucket.set_rate(self.writes_per_second)
+
+        print(f"Rate limited by {self.host}: pausing {delay:.0f}s, writes paced at {self.writes_per_second:.2f}/s")
+        return delay
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_backoffs = 0
+            if self.writes_per_second < self.max_writes_per_second:
+                # Additive increase back to the configured write pace
+                self.writes_per_second = min(self.max_writes_per_second, self.writes_per_second + self.max_writes_per_second / 10)
+                self.write_bucket.set_rate(self.writes_per_second)
+
+    def call(self, function, *args, write=False, **kwargs):
+        # Run a client library call (PyGithub, python-gitlab...) through the scheduler, retrying it when rate limited
+        # The call is counted in the core budget, a retry waits for the budget named by the rate limited answer
+        resource = CORE_RESOURCE
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_slot(write, resource)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                status_code = getattr(e, "status", None) or getattr(e, "response_code", None)
+                headers = getattr(e, "headers", None) or {}
+                if attempt < self.max_retries and self.is_rate_limited(status_code, headers, str(e)):
+                    resource = get_header(headers, "X-RateLimit-Resource") or CORE_RESOURCE
+                    self.update_from_headers(headers)
+                    self.back_off(headers)
+                    continue
+                raise
+            self.record_success()
+            return result
+
+    def get_stats(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent_requests and now - self.recent_requests[0] > 60:
+                self.recent_requests.popleft()
+            core_budget = self.budgets.get(CORE_RESOURCE, {})
+            return {
+                "host": self.host,
+                "requests": self.request_count,
+                "requests_last_minute": len(self.recent_requests),
+                "remaining": core_budget.get("remaining"),
+                "limit": core_budget.get("limit"),
+                "reset_at": core_budget.get("reset_at"),
+                "budgets": {resource: dict(budget) for resource, budget in self.budgets.items()},
+                "writes_per_second": self.writes_per_second,
+                "backoffs": self.backoff_count,
+                "paused_for": max(0, self.paused_until - time.time()),
+            }
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    # requests adapter sending every request of a session through the scheduler of its host
+
+    def __init__(self, scheduler, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        write = request.method in WRITE_METHODS
+        resource = get_rate_limit_resource(request.url)
+        for attempt in range(self.scheduler.max_retries + 1):
+            self.scheduler.wait_for_slot(write, resource)
+            response = super().send(request, **kwargs)
+            self.scheduler.update_from_headers(response.headers)
+            if attempt < self.scheduler.max_retries and self.scheduler.is_rate_limited(response.status_code, response.headers, response.text):
+                self.scheduler.back_off(response.headers)
+                response.close()
+                continue
+            self.scheduler.record_success()
+            return response
+
+
+# One scheduler per host for the whole process
+rate_limit_schedulers = {}
+rate_limit_schedulers_lock = threading.Lock()
+
+def get_rate_limit_scheduler(host):
+    with rate_limit_schedulers_lock:
+        scheduler = rate_limit_schedulers.get(host)
+        if scheduler is None:
+            writes_per_second = GITHUB_WRITES_PER_SECOND if "github" in host else GITLAB_WRITES_PER_SECOND
+            scheduler = RateLimitScheduler(host, writes_per_second)
+            rate_limit_schedulers[host] = scheduler
+        return scheduler
+
+
+def share_write_pace(process_count):
+    # Called in each process of a pool: the processes share the write pace of every host
+    # (the remaining budget is shared anyway, each process reads it from the answer headers)
+    global GITHUB_WRITES_PER_SECOND, GITLAB_WRITES_PER_SECOND
+    GITHUB_WRITES_PER_SECOND = GITHUB_WRITES_PER_SECOND / process_count
+    GITLAB_WRITES_PER_SECOND = GITLAB_WRITES_PER_SECOND / process_count
+    with rate_limit_schedulers_lock:
+        # Schedulers inherited from the parent process
+        for scheduler in rate_limit_schedulers.values():
+            scheduler.max_writes_per_second = scheduler.max_writes_per_second / process_count
+            scheduler.writes_per_second = min(scheduler.writes_per_second, scheduler.max_writes_per_second)
+            scheduler.write_bucket.set_rate(scheduler.writes_per_second)
+
+
+def create_rate_limited_session(host, pool_size=10):
+    # requests session whose https calls go through the scheduler of the host (e.g. for gitlab.Gitlab(session=...))
+    session = requests.Session()
+    session.mount("https://", RateLimitedAdapter(get_rate_limit_scheduler(host), pool_connections=pool_size, pool_maxsize=pool_size))
+    return session
+
+
+def get_rate_limit_stats():
+    with rate_limit_schedulers_lock:
+        schedulers = list(rate_limit_schedulers.values())
+    return [scheduler.get_stats() for scheduler in schedulers]
+
+
+def format_rate_limit_stats(stats):
+    return (f"{stats['host']}: {stats['requests']} requests ({stats['requests_last_minute']} in the last minute), "
+            f"remaining budget: {stats['remaining']}/{stats['limit']}, writes paced at {stats['writes_per_second']:.2f}/s, "
+            f"{stats['backoffs']} backoffs")
@@ -1,11 +1,19 @@
 import os
 import re
-import yaml
 import subprocess
 import git
-from github import Github
+from github_client import get_repository_file, update_repository_file
 from lxml import etree
+from url_rewriter import UrlRewriter, strip_git_suffix
+from devops_service_index import get_devops_service_index
+from git_plumbing import list_tree_blobs, is_partial_clone, fetch_blobs, store_blob, write_tree_with_blobs, commit_tree, update_branch_ref, push_branches
+from pom_scm_patcher import patch_scm_connections, UnsupportedPomError
 import shutil
+import tempfile
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 
 # Define Custom Error exception class
@@ -14,13 +22,24 @@ class UpdatePomXmlError(Exception):
         super().__init__(message)
 
 
-def update_pom_xml_file(xml_file, target_namespace, scm_connection, scm_developer_connection, scm_url):
-    scm_element_successfully_updated = False
+class MissingScmElementError(UpdatePomXmlError):
+    # The pom.xml file has no 'scm' element, a module pom usually inherits the one of its parent
+    pass
+
+
+def update_pom_xml_content(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url):
+    # Return the pom.xml content (bytes) with the updated SCM connections, or None when they are already up to date
+    # The new values are spliced in the original bytes when possible: only the scm values change in the file
+    try:
+        return patch_scm_connections(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url)
+    except UnsupportedPomError:
+        # Unusual documents (other encodings, markup inside the values, XML errors) go through the full parse
+        pass
 
     try:
         parser = etree.XMLParser(strip_cdata=False)
-        tree = etree.parse(xml_file, parser=parser)
-        root = tree.getroot()
+        root = etree.fromstring(xml_content, parser=parser)
+        tree = root.getroottree()
 
         # Define the XML namespace
         namespace = {'ns': target_namespace}
@@ -31,6 +50,16 @@ def update_pom_xml_file(xml_file, target_namespace, scm_connection, scm_develope
         if scm_elements:
             scm_element = scm_elements[0]
 
+            # Nothing to rewrite when the 'scm' element already holds the new connections
+            current_scm_values = [
+                (scm_element.find(".//ns:connection", namespaces=namespace), scm_connection),
+                (scm_element.find(".//ns:developerConnection", namespaces=namespace), scm_developer_connection),
+                (scm_element.find(".//ns:url", namespaces=namespace), scm_url),
+            ]
+            if all(element is None or (element.text or "").strip() == value for element, value in current_scm_values):
+                print("SCM connections are already up to date")
+                return None
+
             # Find and update the 'connection' element within 'scm'
             connection_element = scm_element.find(".//ns:connection", namespaces=namespace)
             if connection_element is not None:
@@ -48,89 +77,427 @@ def update_pom_xml_file(xml_file, target_namespace, scm_connection, scm_develope
             if url_element is not None:
                 url_element.text = scm_url
                 print("Updated URL:", url_element.text)
-            # Write the updated XML back to the file while preserving comments
-            tree.write(xml_file, pretty_print=True, xml_declaration=True, encoding='utf-8')
 
-            scm_element_successfully_updated = True
+            # Serialize the updated XML while preserving comments
+            return etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding='utf-8')
         else:
-            raise UpdatePomXmlError("No 'scm' element found in the pom.xml file.")
+            raise MissingScmElementError("No 'scm' element found in the pom.xml file.")
 
+    except UpdatePomXmlError:
+        raise
     except etree.XMLSyntaxError as e:
         raise UpdatePomXmlError(f"Error parsing XML: {str(e)}")
-    except FileNotFoundError as e:
-        raise UpdatePomXmlError(f"File not found: {str(e)}")
     except Exception as e:
         raise UpdatePomXmlError(f"An error occurred in update_scm_elements: {str(e)}")
-    
-    return scm_element_successfully_updated
 
 
+def update_pom_xml_file(xml_file, target_namespace, scm_connection, scm_developer_connection, scm_url):
+    try:
+        with open(xml_file, "rb") as file:
+            xml_content = file.read()
+    except FileNotFoundError as e:
+        raise UpdatePomXmlError(f"File not found: {str(e)}")
+
+    updated_xml_content = update_pom_xml_content(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url)
+    if updated_xml_content is None:
+        return False
+
+    # Write the updated XML back to the file
+    with open(xml_file, "wb") as file:
+        file.write(updated_xml_content)
+
+    return True
+
+
+def rewrite_pom_xml_content(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url):
+    # Same as update_pom_xml_content but returns (updated_content, error_message, missing_scm), used as the process pool task
+    try:
+        return update_pom_xml_content(xml_content, target_namespace, scm_connection, scm_developer_connection, scm_url), None, False
+    except MissingScmElementError as e:
+        return None, str(e), True
+    except UpdatePomXmlError as e:
+        return None, str(e), False
+
+
+# Process pools rewriting the pom.xml files, one per size for the whole run: they are shared by the repositories and the
+# branch workers instead of being created for every branch
+# Their processes are spawned, not forked: a process forked while another thread holds a lock (stdout, the git readers)
+# would wait on that lock forever
+pom_rewrite_pools = {}
+pom_rewrite_pools_lock = threading.Lock()
+
+def get_pom_rewrite_pool(max_workers=None):
+    with pom_rewrite_pools_lock:
+        pool = pom_rewrite_pools.get(max_workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            pom_rewrite_pools[max_workers] = pool
+        return pool
+
+
+class PomRewriteCache:
+    # Results of the pom.xml rewrites keyed by blob sha: most branches share the same pom.xml blob, which is parsed only once
+    # A result is (updated_content, error_message, missing_scm), updated_content being None when the pom is already up to date or on error
+
+    def __init__(self, target_namespace, scm_connection, scm_developer_connection, scm_url):
+        self.target_namespace = target_namespace
+        self.scm_connection = scm_connection
+        self.scm_developer_connection = scm_developer_connection
+        self.scm_url = scm_url
+        self.results = {}
+        self.updated_binshas = {}
+        self.lock = threading.Lock()
+
+    def rewrite(self, pom_blob):
+        with self.lock:
+            result = self.results.get(pom_blob.hexsha)
+        if result is None:
+            result = rewrite_pom_xml_content(pom_blob.data_stream.read(), self.target_namespace, self.scm_connection, self.scm_developer_connection, self.scm_url)
+            with self.lock:
+                self.results[pom_blob.hexsha] = result
+        return result
+
+    def rewrite_all(self, pom_blobs, max_workers=None):
+        # Rewrite the blobs not seen yet across a process pool, the results are then served by rewrite()
+        with self.lock:
+            pending_blobs = {pom_blob.hexsha: pom_blob for pom_blob in pom_blobs if pom_blob.hexsha not in self.results}
+        if len(pending_blobs) < 2 or max_workers == 1:
+            for pom_blob in pending_blobs.values():
+                self.rewrite(pom_blob)
+            return
+
+        print(f"Rewriting {len(pending_blobs)} distinct pom.xml files in a process pool")
+        executor = get_pom_rewrite_pool(max_workers)
+        futures = {
+            executor.submit(rewrite_pom_xml_content, pom_blob.data_stream.read(), self.target_namespace, self.scm_connection, self.scm_developer_connection, self.scm_url): hexsha
+            for hexsha, pom_blob in pending_blobs.items()
+        }
+        for future in as_completed(futures):
+            with self.lock:
+                self.results[futures[future]] = future.result()
+
+    def store_updated_blob(self, git_repo, pom_blob):
+        # Write the updated content of pom_blob in the object database (once) and return its binary sha
+        with self.lock:
+            updated_binsha = self.updated_binshas.get(pom_blob.hexsha)
+        if updated_binsha is None:
+            updated_binsha = store_blob(git_repo, self.results[pom_blob.hexsha][0])
+            with self.lock:
+                self.updated_binshas[pom_blob.hexsha] = updated_binsha
+        return updated_binsha
+
+
+def get_updated_pom_files(pom_rewrite_cache, branch_name, pom_blobs):
+    # Returns had_error, error_message and the list of (pom_blob, updated_content) to commit on the branch
+    had_error = False
+    error_message = ""
+    updated_pom_files = []
+
+    for pom_blob in pom_blobs:
+        print(f"Updating {pom_blob.path} of branch: {branch_name}")
+        updated_pom_content, pom_error_message, missing_scm = pom_rewrite_cache.rewrite(pom_blob)
+        if missing_scm and pom_blob.path != "pom.xml":
+            # A module pom without 'scm' element inherits the one of its parent, only the root pom must have one
+            print(f"Skipping {pom_blob.path} of branch: {branch_name}, it has no 'scm' element")
+        elif pom_error_message:
+            print(f"An error occurred in update_pom_xml_file: {pom_error_message}")
+            had_error = True
+            error_message = error_message + f"===> An error occurred in update_pom_xml_file on branch: {branch_name}, file: {pom_blob.path}, error message: {pom_error_message} \n"
+        elif updated_pom_content is None:
+            # The file already points to the new SCM connections
+            print(f"Skipping {pom_blob.path} of branch: {branch_name}, SCM connections are already up to date")
+        else:
+            updated_pom_files.append((pom_blob, updated_pom_content))
+
+    return had_error, error_message, updated_pom_files
+
+
+def get_pom_commit_message(branch_name, updated_pom_files):
+    if len(updated_pom_files) == 1:
+        return f"Update '{updated_pom_files[0][0].path}' for branch: {branch_name}"
+    return f"Update {len(updated_pom_files)} 'pom.xml' files for branch: {branch_name}"
+
+
+def update_scm_connections_in_branch_trees(git_repo, pom_rewrite_cache, pom_workers=None, skipped_branches=()):
+    # Rewrite the pom.xml files of every branch directly in the object database, without any working tree
+    # Returns had_error, error_message, the names of the processed branches, of the updated ones and of the ones that failed
+    had_error = False
+    error_message = ""
+    processed_branches = []
+    updated_branches = []
+    failed_branches = set()
+    filename = "pom.xml"
+
+    # List the pom.xml files of every module on every branch, then rewrite the distinct blobs all at once
+    branch_pom_blobs = []
+    for head in git_repo.heads:
+        if head.name in skipped_branches:
+            print(f"Skipping branch already updated: {head.name}")
+            continue
+        processed_branches.append(head.name)
+        pom_blobs = list_tree_blobs(git_repo, head.commit, filename)
+        if pom_blobs:
+            branch_pom_blobs.append((head.name, head.commit, pom_blobs))
+    all_pom_blobs = [pom_blob for _, _, pom_blobs in branch_pom_blobs for pom_blob in pom_blobs]
+    if is_partial_clone(git_repo):
+        # Only the pom.xml files are downloaded, all at once
+        fetch_blobs(git_repo, all_pom_blobs)
+    pom_rewrite_cache.rewrite_all(all_pom_blobs, pom_workers)
+
+    for branch_name, branch_commit, pom_blobs in branch_pom_blobs:
+        branch_had_error, branch_error_message, updated_pom_files = get_updated_pom_files(pom_rewrite_cache, branch_name, pom_blobs)
+        if branch_had_error:
+            had_error = True
+            error_message = error_message + branch_error_message
+            failed_branches.add(branch_name)
+        if not updated_pom_files:
+            # The branch already points to the new SCM connections, nothing to commit or push
+            print(f"Nothing to commit on branch: {branch_name}")
+            continue
+
+        # Build the new blobs, trees and commit, then move the branch on the new commit
+        updated_blobs = {pom_blob.path: (pom_rewrite_cache.store_updated_blob(git_repo, pom_blob), pom_blob.mode) for pom_blob, _ in updated_pom_files}
+        updated_tree = write_tree_with_blobs(git_repo, branch_commit.tree, updated_blobs)
+        updated_commit = commit_tree(git_repo, updated_tree, get_pom_commit_message(branch_name, updated_pom_files), branch_commit)
+        update_branch_ref(git_repo, branch_name, updated_commit, branch_commit)
+        updated_branches.append(branch_name)
+
+    return had_error, error_message, processed_branches, updated_branches, failed_branches
+
+
+def push_updated_branches(git_repo, updated_branches, atomic_push):
+    # Push all the updated branches at once, returns had_error, the error message and the names of the branches that failed
+    had_error = False
+    error_message = ""
+    failed_branches = set()
+    if not updated_branches:
+        return had_error, error_message, failed_branches
+
+    print(f"Pushing {len(updated_branches)} branches to GitHub")
+    push_errors = push_branches(git_repo, updated_branches, atomic_push)
+    for branch_name in updated_branches:
+        if branch_name in push_errors:
+            print(f"Failed to push branch: {branch_name}: {push_errors[branch_name]}")
+            had_error = True
+            error_message = error_message + f"===> Failed to push changes for branch: {branch_name}, error message: {push_errors[branch_name]} \n"
+            failed_branches.add(branch_name)
+        else:
+            print(f"Pushed changes for branch: {branch_name} to GitHub")
+    return had_error, error_message, failed_branches
+
+
+def report_done_branches(processed_branches, failed_branches, on_branch_done):
+    # Tell the caller which branches are up to date on GitHub (pushed or nothing to change)
+    if on_branch_done is None:
+        return
+    for branch_name in processed_branches:
+        if branch_name not in failed_branches:
+            on_branch_done(branch_name)
+
+
+def clone_repository(github_project_url, github_signed_url, repo_dir, bare=False, mirror_cache=None, previous_urls=(), partial_fetch=False):
+    # Clone from the local mirror of the repository (refreshed with the changes since the last run) when there is a mirror cache
+    # partial_fetch: only the tip commit and the trees of every branch, the blobs are downloaded when they are read,
+    # and a working tree only checks out the pom.xml files
+    if mirror_cache is not None:
+        return mirror_cache.clone(github_project_url, github_signed_url, repo_dir, bare, previous_urls)
+    if not partial_fetch:
+        return git.Repo.clone_from(github_signed_url, repo_dir, bare=bare)
+
+    git_repo = git.Repo.clone_from(github_signed_url, repo_dir, bare=bare, filter="blob:none", depth=1, no_single_branch=True, no_checkout=not bare)
+    if not bare:
+        git_repo.git.sparse_checkout("set", "--no-cone", "**/pom.xml")
+    return git_repo
+
 
-def update_scm_connections_in_maven_repositories(github_project_url, github_access_token, github_project_path_segment):
+def commit_updated_pom_files(git_repo, repo_dir, branch_name, pom_rewrite_cache, pom_workers=None):
+    # Rewrite the pom.xml files of the branch checked out in repo_dir and commit them
+    # Returns had_error, error_message and whether the branch has a new commit to push
+    had_error = False
+    error_message = ""
+    filename = "pom.xml"
+
+    # List the 'pom.xml' files of all the modules, the checked out files are the blobs of the branch tree
+    pom_blobs = list_tree_blobs(git_repo, git_repo.head.commit, filename)
+    if not pom_blobs:
+        return had_error, error_message, False
+
+    pom_rewrite_cache.rewrite_all(pom_blobs, pom_workers)
+    had_error, error_message, updated_pom_files = get_updated_pom_files(pom_rewrite_cache, branch_name, pom_blobs)
+    if had_error:
+        print("An issue occurred during updating SCM connections in the pom file")
+
+    if not updated_pom_files:
+        # The branch already points to the new SCM connections, nothing to commit or push
+        print(f"Nothing to commit on branch: {branch_name}")
+        return had_error, error_message, False
+
+    # Write the updated XML back to the files
+    for pom_blob, updated_pom_content in updated_pom_files:
+        with open(os.path.join(repo_dir, pom_blob.path), "wb") as file:
+            file.write(updated_pom_content)
+    print("SCM connections were successfully updated in the pom files")
+
+    # Commit the changes of all the modules at once
+    # The worktree threads share the process and the git directory: "git add" rather than index.add, which changes the
+    # current directory, and no hooks, whose COMMIT_EDITMSG file is shared (a fresh clone has no hooks anyway)
+    git_repo.git.add("--", *[pom_blob.path for pom_blob, _ in updated_pom_files])
+    git_repo.index.commit(get_pom_commit_message(branch_name, updated_pom_files), skip_hooks=True)
+    return had_error, error_message, True
+
+
+def update_scm_connections_in_worktrees(git_repo, repo_dir, branch_names, pom_rewrite_cache, pom_workers=None, branch_workers=2):
+    # Check out and update the branches with branch_workers threads, each one in its own "git worktree" of the clone
+    # The worktrees share the object database and the refs of the clone: the new commits are pushed from git_repo
+    # Returns had_error, error_message, the names of the updated branches and of the ones that failed
+    had_error = False
+    error_message = ""
+    updated_branches = []
+    failed_branches = set()
+
+    # A branch can only be checked out in one working tree, the main one lets go of its branch
+    git_repo.git.checkout("--detach")
+    sparse_checkout = is_partial_clone(git_repo)
+
+    # Each worktree has its own Repo: the object readers of GitPython can not be shared between threads
+    worktrees = queue.Queue()
+    worktree_repos = []
+    for index in range(min(branch_workers, len(branch_names))):
+        worktree_dir = f"{repo_dir}_worktree_{index}"
+        git_repo.git.worktree("add", "--detach", "--no-checkout", worktree_dir)
+        worktree_repo = git.Repo(worktree_dir)
+        if sparse_checkout:
+            worktree_repo.git.sparse_checkout("set", "--no-cone", "**/pom.xml")
+        worktree_repos.append(worktree_repo)
+        worktrees.put((worktree_dir, worktree_repo))
+
+    def update_branch(branch_name):
+        worktree_dir, worktree_repo = worktrees.get()
+        try:
+            print(f"Checking out branch: {branch_name} in {worktree_dir}")
+            # No upstream is set up: the threads don't write the shared config, the push names its refs
+            worktree_repo.git.checkout("--no-track", "-B", branch_name, f"origin/{branch_name}")
+            return commit_updated_pom_files(worktree_repo, worktree_dir, branch_name, pom_rewrite_cache, pom_workers)
+        except git.exc.GitError as e:
+            print(f"***edit_pom_xml*** Git error on branch {branch_name}: {e}")
+            return True, f"===> A Git error occured on branch: {branch_name}, error message: {e} \n", False
+        finally:
+            worktrees.put((worktree_dir, worktree_repo))
+
+    print(f"Updating {len(branch_names)} branches in {len(worktree_repos)} worktrees")
+    try:
+        with ThreadPoolExecutor(max_workers=len(worktree_repos)) as executor:
+            for branch_name, (branch_had_error, branch_error_message, branch_updated) in zip(branch_names, executor.map(update_branch, branch_names)):
+                if branch_had_error:
+                    had_error = True
+                    error_message = error_message + branch_error_message
+                    failed_branches.add(branch_name)
+                if branch_updated:
+                    updated_branches.append(branch_name)
+    finally:
+        for worktree_repo in worktree_repos:
+            worktree_repo.close()
+
+    return had_error, error_message, updated_branches, failed_branches
+
+
+def update_scm_connections_in_maven_repositories(github_project_url, github_access_token, github_project_path_segment, checkout_free=False, pom_workers=None, atomic_push=False, skipped_branches=(), on_branch_done=None, mirror_cache=None, previous_urls=(), partial_fetch=False, branch_workers=1):
+    # checkout_free: rewrite the pom.xml files in the git object database of a bare clone instead of checking out every branch
+    # pom_workers: size of the process pool rewriting the pom.xml files of the modules (default: number of CPUs)
+    # atomic_push: the single push of the updated branches updates either all of them or none
+    # skipped_branches: branches already updated by a previous run, they are left as they are
+    # on_branch_done: called with the name of each branch once it is up to date on GitHub
+    # mirror_cache: MirrorCache the repository is cloned from, previous_urls are the urls of the repository before its rename
+    # partial_fetch: clone without history nor blobs, only the pom.xml files are downloaded (ignored with a mirror cache)
+    # branch_workers: number of branches checked out and updated at the same time, each in its own worktree (ignored with checkout_free)
     print(" Edit pom.xml files")
     had_error = False
     error_message = ""
-    tmp_dir = os.path.join(os.getcwd(), "temp_dir")
+    tmp_dir = None
 
     try:
-        # Create a directory to clone the repository into
+        # Create a directory to clone the repository into, one per call so that concurrent projects don't share it
         repo_name = github_project_url.split("/")[-1].replace(".git", "")
+        tmp_root_dir = os.path.join(os.getcwd(), "temp_dir")
+        os.makedirs(tmp_root_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f"{repo_name}_", dir=tmp_root_dir)
         repo_dir = os.path.join(tmp_dir, repo_name)
 
         # Create a Pre-signed repository Url
         github_signed_url = github_project_url.replace("https://", f"https://{github_access_token}@")
 
-        print(f" Clone repo: {repo_name}")
-        # Clone the private repository with the access token embedded in the URL
-        git.Repo.clone_from(github_signed_url, repo_dir)
-
-        # Initialize a Git repository object
-        git_repo = git.Repo(repo_dir)
-
-        # Fetch all remote branches
-        git_repo.remotes.origin.fetch()
-
         # Prepare new SCM connections
-        filename = "pom.xml"
         target_xml_namespace = "http://maven.apache.org/POM/4.0.0"
         scm_connection = f"scm:git:git@github.com:{github_project_path_segment}.git"    
         scm_developer_connection = f"scm:git:git@github.com:{github_project_path_segment}.git"
         scm_url = f"https://github.com/{github_project_path_segment}"
+        pom_rewrite_cache = PomRewriteCache(target_xml_namespace, scm_connection, scm_developer_connection, scm_url)
+
+        if checkout_free:
+            print(f" Clone bare repo: {repo_name}")
+            # A bare clone has a local branch for every remote branch and no working tree
+            git_repo = clone_repository(github_project_url, github_signed_url, repo_dir, True, mirror_cache, previous_urls, partial_fetch)
+
+            trees_had_error, trees_error_message, processed_branches, updated_branches, failed_branches = update_scm_connections_in_branch_trees(git_repo, pom_rewrite_cache, pom_workers, skipped_branches)
+            if trees_had_error:
+                had_error = True
+                error_message = error_message + trees_error_message
+
+            # Push the changes of all the branches to GitHub
+            push_had_error, push_error_message, failed_push_branches = push_updated_branches(git_repo, updated_branches, atomic_push)
+            if push_had_error:
+                had_error = True
+                error_message = error_message + push_error_message
+            report_done_branches(processed_branches, failed_branches | failed_push_branches, on_branch_done)
+
+            # Remove the cloned project from the local filesystem
+            print(f" Cleaning repo directory: {repo_dir}")
+            shutil.rmtree(repo_dir)
+            return had_error, error_message
+
+        print(f" Clone repo: {repo_name}")
+        # Clone the private repository with the access token embedded in the URL
+        # The clone has already fetched all remote branches
+        git_repo = clone_repository(github_project_url, github_signed_url, repo_dir, False, mirror_cache, previous_urls, partial_fetch)
+
+        processed_branches = []
+        updated_branches = []
+        failed_branches = set()
 
         # Iterate through all remote branches
         for remote_ref in git_repo.remotes.origin.refs:
             if remote_ref.remote_head:
                 branch_name = remote_ref.remote_head
-                if branch_name != "HEAD":
-                    print(f"Checking out branch: {branch_name}")
-                    git_repo.git.checkout(branch_name)
-
-                    # Check if 'pom.xml' file exists
-                    pom_xml_path = os.path.join(repo_dir, filename)
-                    if os.path.exists(pom_xml_path):
-                        pom_successfully_updated = False
-                        try:
-                            pom_successfully_updated = update_pom_xml_file(pom_xml_path, target_xml_namespace, scm_connection, scm_developer_connection, scm_url)
-                        except UpdatePomXmlError as e:
-                            print(f"An error occurred in update_pom_xml_file: {str(e)}")
-                            had_error = True
-                            error_message = error_message + f"===> An error occurred in update_pom_xml_file on branch: {branch_name}, error message: {str(e)} \n"
-
-                        if pom_successfully_updated:
-                            print("SCM connections were successfully updated in the pom file")
-
-                            # Commit the changes
-                            git_repo.index.add(['pom.xml'])
-                            git_repo.index.commit(f"Update 'pom.xml' for branch: {branch_name}")
-
-                            # Push the changes to GitHub
-                            git_repo.remotes.origin.push(branch_name)
-                            print(f"Pushed changes for branch: {branch_name} to GitHub")
-                        else:
-                            print("An issue occurred during updating SCM connections in the pom file")
-                            had_error = True
-                            error_message = error_message + f"===> An issue occurred during updating SCM connections in the pom.xml file on branch: {branch_name} \n"
-            
+                if branch_name in skipped_branches:
+                    print(f"Skipping branch already updated: {branch_name}")
+                elif branch_name != "HEAD":
+                    processed_branches.append(branch_name)
+
+        if branch_workers > 1 and len(processed_branches) > 1:
+            worktrees_had_error, worktrees_error_message, updated_branches, failed_branches = update_scm_connections_in_worktrees(git_repo, repo_dir, processed_branches, pom_rewrite_cache, pom_workers, branch_workers)
+            if worktrees_had_error:
+                had_error = True
+                error_message = error_message + worktrees_error_message
+        else:
+            for branch_name in processed_branches:
+                print(f"Checking out branch: {branch_name}")
+                git_repo.git.checkout(branch_name)
+
+                branch_had_error, branch_error_message, branch_updated = commit_updated_pom_files(git_repo, repo_dir, branch_name, pom_rewrite_cache, pom_workers)
+                if branch_had_error:
+                    had_error = True
+                    error_message = error_message + branch_error_message
+                    failed_branches.add(branch_name)
+                if branch_updated:
+                    updated_branches.append(branch_name)
+
+        # Push the changes of all the branches to GitHub
+        push_had_error, push_error_message, failed_push_branches = push_updated_branches(git_repo, updated_branches, atomic_push)
+        if push_had_error:
+            had_error = True
+            error_message = error_message + push_error_message
+        report_done_branches(processed_branches, failed_branches | failed_push_branches, on_branch_done)
+
         # Remove the cloned project from the local filesystem
         print(f" Cleaning repo directory: {repo_dir}")
         shutil.rmtree(repo_dir)
@@ -145,23 +512,14 @@ def update_scm_connections_in_maven_repositories(github_project_url, github_acce
         error_message = error_message + f"===> An unexpected error occurred: {e} \n"
     finally:
         # Clean up by deleting the temporary directory
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
         return had_error, error_message 
 
 
-def get_service_names(file_content, old_url):
-    service_names = []
-
-    data = yaml.safe_load(file_content)
-    for service_name, service_info in data.get('ado_pipelines', {}).items():
-        if 'build' in service_info:
-            found = False
-            for build_step in service_info['build']:
-                if 'repository' in build_step and old_url in build_step['repository'] :
-                    found = True
-            if found:
-                service_names.append(service_name)
-    return service_names
+def get_service_names(file_content, old_url, file_sha=None):
+    # Services whose build steps use the old_url repository, looked up in the index of this file version
+    return get_devops_service_index(file_content, file_sha).get_service_names(old_url)
 
 
 def update_azure_devops_services (github_repo_url, github_token, github_repo_branch_name, github_file_path, old_string, new_string):
@@ -177,40 +535,23 @@ def update_azure_devops_services (github_repo_url, github_token, github_repo_bra
         print (f"File Path: {github_file_path}")
         print (f"Changing Gitlab url: {old_string} with new Github url: {new_string}")
 
-        # Create a Github instance and authenticate with your personal access token
-        g = Github(github_token)
-
-        # Get the specified repository
-        repo = g.get_repo(f"{username}/{repo_name}")
-
-        # Get the repo branch
-        repo_branch = repo.get_branch(github_repo_branch_name)
+        # Get the file content of the branch, an unchanged file is answered with a 304 that costs no rate limit
+        file_content, file_sha = get_repository_file(github_token, f"{username}/{repo_name}", github_file_path, github_repo_branch_name)
 
-        # Get the file content
-        file = repo.get_contents(github_file_path, ref=repo_branch.name)
+        # Replace old_string with new_string in the file content, on url boundaries only
+        updated_content, hits = UrlRewriter({old_string: new_string}).rewrite(file_content)
 
-        # Read the content of the file
-        file_content = file.decoded_content.decode("utf-8")
+        # Check if old_string exists in file_content before updating it
+        if hits:
 
-        # Check if old_string exists in file_content before replacing it
-        if old_string in file_content:
-
-            changed_services = get_service_names (file_content, old_string)
-
-            # Replace old_string with new_string in the file content
-            updated_content = file_content.replace(old_string, new_string)
+            changed_services = get_service_names (file_content, old_string, file_sha)
 
             # Retrive the new project name
             project_name = new_string.strip("/").split("/")[-1]
             
             # Update the file with the new content
-            repo.update_file(
-                path=github_file_path,
-                message=f"Change Gitlab url to Github url for {project_name}",
-                content=updated_content,
-                sha=file.sha,
-                branch=repo_branch.name
-            )
+            update_repository_file(github_token, f"{username}/{repo_name}", github_file_path, github_repo_branch_name,
+                updated_content, file_sha, f"Change Gitlab url to Github url for {project_name}")
 
             print("File updated and committed successfully!")
         else:
@@ -226,6 +567,68 @@ def update_azure_devops_services (github_repo_url, github_token, github_repo_bra
 
 
 
+def update_azure_devops_services_batch(github_repo_url, github_token, github_repo_branch_name, github_file_path, url_replacements, commits_count=1):
+    # url_replacements is a list of (old_string, new_string) tuples, one per project
+    # Returns the global error and, for each old_string, its own (had_error, error_message, changed_services)
+    had_error = False
+    error_message = ""
+    results = {}
+    try:
+        # Extract the username and repository name from the GitHub URL
+        repo_url_parts = github_repo_url.strip("/").split("/")
+        username, repo_name = repo_url_parts[-2], repo_url_parts[-1]
+
+        print (f"Github Project: {github_repo_url} , Branch: {github_repo_branch_name}")
+        print (f"File Path: {github_file_path}")
+        print (f"Changing {len(url_replacements)} Gitlab urls with their new Github urls")
+
+        # Get the file content of the branch only once for all the projects, an unchanged file is answered with a 304
+        file_content, file_sha = get_repository_file(github_token, f"{username}/{repo_name}", github_file_path, github_repo_branch_name)
+
+        # Split the replacements in chunks, one commit per chunk
+        commits_count = max(1, min(commits_count, len(url_replacements)))
+        chunk_size = -(-len(url_replacements) // commits_count)
+        for chunk_start in range(0, len(url_replacements), chunk_size):
+            chunk = url_replacements[chunk_start:chunk_start + chunk_size]
+            updated_projects = []
+            chunk_results = {}
+
+            # Replace all the urls of the chunk in one scan of the file content
+            url_rewriter = UrlRewriter(dict(chunk))
+            updated_content, hits = url_rewriter.rewrite(file_content)
+            replaced_urls = {old_url for offset, old_url, new_url in hits}
+
+            for old_string, new_string in chunk:
+                # Check if old_string exists in the file content
+                if strip_git_suffix(old_string) in replaced_urls:
+                    changed_services = get_service_names (file_content, old_string, file_sha)
+                    updated_projects.append(new_string.strip("/").split("/")[-1])
+                    chunk_results[old_string] = (False, "", changed_services)
+                else:
+                    chunk_results[old_string] = (True, f"===>  Warning!! Gitlab URL: {old_string} was not found in {github_file_path}", [])
+
+            if updated_projects:
+                # Update the file with the new content, the returned sha is used by the next chunk
+                file_sha = update_repository_file(github_token, f"{username}/{repo_name}", github_file_path, github_repo_branch_name,
+                    updated_content, file_sha, f"Change Gitlab url to Github url for {', '.join(updated_projects)}")
+                file_content = updated_content
+                print(f"File updated and committed successfully for {len(updated_projects)} projects!")
+
+            # The chunk results are only kept once the chunk is committed
+            results.update(chunk_results)
+
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        had_error = True
+        error_message = f"===> An error occurred: {str(e)}"
+        # Projects of the chunks that were not committed are reported with the global error
+        for old_string, new_string in url_replacements:
+            if old_string not in results:
+                results[old_string] = (True, error_message, [])
+    finally:
+        return had_error, error_message, results
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+from collections import deque
+
+
+class SpillQueue:
+    # FIFO queue between a producer and consumer threads that keeps at most max_items in memory
+    # The overflow is written to gzip compressed JSONL segment files, read back in order once the memory is drained
+    # Items must be JSON serializable
+
+    def __init__(self, max_items, spool_directory, segment_size=100):
+        self.max_items = max_items
+        self.segment_size = min(segment_size, max_items)
+        os.makedirs(spool_directory, exist_ok=True)
+        self.spool_directory = tempfile.mkdtemp(prefix="spool_", dir=spool_directory)
+
+        self.items = deque()
+        self.segments = deque()
+        self.writing_segment = None
+        self.segment_number = 0
+        self.spilled_count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        with self.condition:
+            # Once items are spilled, the next ones follow them on disk to keep the order
+            if not self.segments and self.writing_segment is None and len(self.items) < self.max_items:
+                self.items.append(item)
+            else:
+                self.spill(item)
+            self.condition.notify()
+
+    def spill(self, item):
+        if self.writing_segment is None:
+            segment_path = os.path.join(self.spool_directory, f"{self.segment_number:06d}.jsonl.gz")
+            self.segment_number += 1
+            self.writing_segment = [segment_path, gzip.open(segment_path, "wt", encoding="utf-8"), 0]
+        self.writing_segment[1].write(json.dumps(item) + "\n")
+        self.writing_segment[2] += 1
+        self.spilled_count += 1
+        if self.writing_segment[2] >= self.segment_size:
+            self.close_segment()
+
+    def close_segment(self):
+        segment_path, segment_file, _ = self.writing_segment
+        segment_file.close()
+        self.segments.append(segment_path)
+        self.writing_segment = None
+
+    def get(self):
+        # Next item, blocks until there is one, returns None once the queue is closed and empty
+        with self.condition:
+            while True:
+                if self.items:
+                    return self.items.popleft()
+                if not self.segments and self.writing_segment is not None:
+                    self.close_segment()
+                if self.segments:
+                    segment_path = self.segments.popleft()
+                    with gzip.open(segment_path, "rt", encoding="utf-8") as segment_file:
+                        self.items.extend(json.loads(line) for line in segment_file)
+                    os.remove(segment_path)
+                    continue
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+    def close(self):
+        # No more items will be put, the consumers get None once the queue is empty
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def cleanup(self):
+        with self.condition:
+            if self.writing_segment is not None:
+                self.writing_segment[1].close()
+                self.writing_segment = None
+        shutil.rmtree(self.spool_directory, ignore_errors=True)
@@ -0,0 +1,211 @@
+import csv
+from collections import deque
+
+
+# Characters that continue a repository name, a match followed or preceded by one of them is only the prefix of another url
+URL_NAME_CHARACTERS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_")
+
+
+def strip_git_suffix(url):
+    # Remove the ".git" suffix of a repository url (and only the suffix)
+    url = url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[:-len(".git")]
+    return url
+
+
+def normalize_repository_url(url):
+    # Same repository url whatever its form: ssh or https, with or without credentials, ".git" suffix or trailing "/"
+    url = strip_git_suffix(url)
+    if url.startswith("ssh://"):
+        url = url[len("ssh://"):]
+        host, _, path = url.partition("/")
+        host = host.rsplit("@", 1)[-1].split(":")[0]
+        url = f"https://{host}/{path}"
+    elif "://" not in url and "@" in url.split("/")[0] and ":" in url:
+        # scp-like syntax: git@gitlab.com:group/project
+        host, _, path = url.partition(":")
+        url = f"https://{host.rsplit('@', 1)[-1]}/{path.lstrip('/')}"
+    scheme, separator, rest = url.partition("://")
+    if not separator:
+        return url
+    host, _, path = rest.partition("/")
+    host = host.rsplit("@", 1)[-1].lower()
+    scheme = "https" if scheme.lower() in ("http", "https", "git") else scheme.lower()
+    return f"{scheme}://{host}/{path}".rstrip("/")
+
+
+def is_url_start_boundary(text, start):
+    if start == 0:
+        return True
+    previous_character = text[start - 1]
+    return previous_character not in URL_NAME_CHARACTERS and previous_character != "."
+
+
+def is_url_end_boundary(text, end):
+    if end >= len(text):
+        return True
+    next_character = text[end]
+    if next_character in URL_NAME_CHARACTERS:
+        return False
+    if next_character == ".":
+        # "<url>.git" is the same repository, "<url>.v2" is another one, a "." ending a sentence is a boundary
+        if text.startswith(".git", end):
+            return is_url_end_boundary(text, end + len(".git"))
+        return end + 1 >= len(text) or (text[end + 1] not in URL_NAME_CHARACTERS and text[end + 1] != ".")
+    return True
+
+
+class UrlRewriter:
+    # Replace every url of a mapping table in one scan of the text (Aho-Corasick automaton)
+    # Urls are matched on their boundaries, and when several urls match at the same offset the longest one wins,
+    # so ".../core/b2c-evse-manager" never rewrites ".../core/b2c-evse-manager-v2"
+
+    def __init__(self, url_mapping):
+        # url_mapping: {old_url: new_url}, the ".git" suffixes are ignored when matching
+        self.url_mapping = dict(url_mapping)
+        self.patterns = []
+        self.replacements = []
+        self.normalized_mapping = {}
+        for old_url, new_url in self.url_mapping.items():
+            old_pattern = strip_git_suffix(old_url)
+            if not old_pattern or old_pattern in self.normalized_mapping:
+                continue
+            self.normalized_mapping[old_pattern] = new_url
+            self.patterns.append(old_pattern)
+            self.replacements.append(strip_git_suffix(new_url))
+        self.build_automaton()
+
+    def build_automaton(self):
+        # Trie of the patterns
+        self.transitions = [{}]
+        self.pattern_at_node = [None]
+        for pattern_index, pattern in enumerate(self.patterns):
+            node = 0
+            for character in pattern:
+                next_node = self.transitions[node].get(character)
+                if next_node is None:
+                    next_node = len(self.transitions)
+                    self.transitions[node][character] = next_node
+                    self.transitions.append({})
+                    self.pattern_at_node.append(None)
+                node = next_node
+            self.pattern_at_node[node] = pattern_index
+
+        # Failure links and output links (closest node on the failure chain that ends a pattern), built breadth first
+        self.failure_links = [0] * len(self.transitions)
+        self.output_links = [None] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for character, next_node in self.transitions[node].items():
+                failure = self.failure_links[node]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failure_links[failure]
+                failure_node = self.transitions[failure].get(character, 0)
+                self.failure_links[next_node] = failure_node if failure_node != next_node else 0
+                if self.pattern_at_node[self.failure_links[next_node]] is not None:
+                    self.output_links[next_node] = self.failure_links[next_node]
+                else:
+                    self.output_links[next_node] = self.output_links[self.failure_links[next_node]]
+                queue.append(next_node)
+
+    def find(self, text):
+        # Return the non overlapping hits as a list of (offset, old_url, new_url), ordered by offset
+        candidates = []
+        node = 0
+        for position, character in enumerate(text):
+            while node and character not in self.transitions[node]:
+                node = self.failure_links[node]
+            node = self.transitions[node].get(character, 0)
+
+            output_node = node if self.pattern_at_node[node] is not None else self.output_links[node]
+            while output_node is not None:
+                pattern_index = self.pattern_at_node[output_node]
+                end = position + 1
+                start = end - len(self.patterns[pattern_index])
+                if is_url_start_boundary(text, start) and is_url_end_boundary(text, end):
+                    candidates.append((start, end, pattern_index))
+                output_node = self.output_links[output_node]
+
+        # Leftmost longest matches win
+        candidates.sort(key=lambda candidate: (candidate[0], candidate[0] - candidate[1]))
+        hits = []
+        last_end = 0
+        for start, end, pattern_index in candidates:
+            if start >= last_end:
+                hits.append((start, self.patterns[pattern_index], self.replacements[pattern_index]))
+                last_end = end
+        return hits
+
+    def rewrite(self, text):
+        # Return the rewritten text and its hits, offsets are those of the original text
+        hits = self.find(text)
+        if not hits:
+            return text, hits
+        parts = []
+        last_end = 0
+        for offset, old_url, new_url in hits:
+            parts.append(text[last_end:offset])
+            parts.append(new_url)
+            last_end = offset + len(old_url)
+        parts.append(text[last_end:])
+        return "".join(parts), hits
+
+    def lookup(self, url):
+        # Return the new url mapped to the whole url, or None
+        return self.normalized_mapping.get(strip_git_suffix(url))
+
+
+class RepositoryUrlIndex:
+    # Mapping table looked up by normalized repository url (see normalize_repository_url):
+    # "git@gitlab.com:group/project", "ssh://git@gitlab.com/group/project.git" and "https://gitlab.com/group/project/" are the same key
+
+    def __init__(self, url_mapping):
+        self.normalized_mapping = {}
+        for old_url, new_url in url_mapping.items():
+            self.normalized_mapping.setdefault(normalize_repository_url(old_url), new_url)
+
+    def lookup(self, url):
+        # Return the new url mapped to the repository, or None
+        return self.normalized_mapping.get(normalize_repository_url(url))
+
+    def __len__(self):
+        return len(self.normalized_mapping)
+
+
+def get_remote_mapping(file_path):
+    # Read the mapping of remote-list.txt (Old_Gitlab_Remote, New_Github_Remote)
+    remote_mapping = {}
+    with open(file_path, newline='') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter='\t')
+        for row in reader:
+            gitlab_remote = (row.get('Old_Gitlab_Remote') or '').strip()
+            github_remote = (row.get('New_Github_Remote') or '').strip()
+            if gitlab_remote and github_remote:
+                remote_mapping[gitlab_remote] = github_remote
+    return remote_mapping
+
+
+def get_project_url_mapping(projects, github_org_name):
+    # Mapping of the project list (see utils.get_project_list): old Gitlab url -> url of the renamed Github repository
+    return {
+        project["old_gitlab_repo_url"]: f"https://github.com/{github_org_name}/{project['new_repo_name']}"
+        for project in projects
+    }
+
+
+# Example usage
+def main():
+    rewriter = UrlRewriter({
+        "https://gitlab.com/symphony-cloud/infrastructure/core/b2c-evse-manager.git": "https://github.com/ae-organization/tcs-b2c-evse-manager.git",
+        "https://gitlab.com/symphony-cloud/infrastructure/core/b2c-evse-manager-v2.git": "https://github.com/ae-organization/tcs-b2c-evse-manager-v2.git",
+    })
+    text = "repository: https://gitlab.com/symphony-cloud/infrastructure/core/b2c-evse-manager-v2\nrepository: https://gitlab.com/symphony-cloud/infrastructure/core/b2c-evse-manager.git\n"
+    new_text, hits = rewriter.rewrite(text)
+    for offset, old_url, new_url in hits:
+        print(f"{offset}: {old_url} -> {new_url}")
+    print(new_text)
+
+if __name__ == "__main__":
+    main()
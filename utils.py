@@ -1,4 +1,6 @@
 import csv
+import threading
+from contextlib import contextmanager
 
 def get_project_list (file_path):
     project_list = []
@@ -27,6 +29,38 @@ def get_project_list (file_path):
 
     return project_list
 
+
+# Lock shared by every worker writing to the output files of a run
+output_file_lock = threading.Lock()
+
+def append_lines_to_file(file_path, lines):
+    # Write all the lines in one locked append so concurrent projects never interleave
+    with output_file_lock:
+        with open(file_path, "a") as file:
+            for line in lines:
+                file.write(line + '\n')
+
+
+# Maximum number of concurrent calls allowed per remote host
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+def configure_host_limits(host_limits):
+    with host_semaphores_lock:
+        for host, limit in host_limits.items():
+            host_semaphores[host] = threading.BoundedSemaphore(max(1, int(limit)))
+
+@contextmanager
+def host_slot(host):
+    # Hosts without a configured limit are not throttled
+    with host_semaphores_lock:
+        semaphore = host_semaphores.get(host)
+    if semaphore is None:
+        yield
+        return
+    with semaphore:
+        yield
+
 # Example usage
 def main():
     try: